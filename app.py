@@ -1,17 +1,49 @@
 import os
 from functools import wraps
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, session
+from flask import Flask, Response, render_template, redirect, url_for, flash, request, jsonify, session, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_wtf.csrf import CSRFProtect, generate_csrf
-from models import db, User, Quest, QuestCompletion, Transaction
-from datetime import date, datetime
+from models import db, User, Quest, QuestCompletion, QuestCompletionMonth, Transaction, DailyActivity
+import balance
+from pagination import keyset_paginate, page_url
+from catalog import quest_catalog
+from usercache import user_cache, load_db_user
+import stats
+from commands import register_commands, bootstrap, precompile_templates
+from jinja2 import FileSystemBytecodeCache
+from assets import AssetManifest, IMMUTABLE_CACHE_CONTROL
+from compression import CompressionMiddleware, send_static
+from pagecache import page_cache
+import serving
+from passwords import PasswordHashingBusy
+import metrics
+from replica import REPLICA_BIND, replica_url, replica_reads, use_replica, watch_replica
+import exports
+import referrals
+from datetime import datetime
 
 app = Flask(__name__)
+# Compiled templates are cached on disk (JINJA_BYTECODE_DIR, or a per-user
+# temp dir) so new workers load bytecode instead of parsing every template.
+# Deployments point JINJA_BYTECODE_DIR inside the app so `flask build` fills
+# it at build time.
+jinja_bytecode_dir = os.environ.get('JINJA_BYTECODE_DIR') or None
+if jinja_bytecode_dir:
+    os.makedirs(jinja_bytecode_dir, exist_ok=True)
+app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(jinja_bytecode_dir)}
 app.secret_key = os.environ.get("SESSION_SECRET") or os.environ.get("SECRET_KEY") or "dev-secret-key-change-in-production"
 
 from werkzeug.middleware.proxy_fix import ProxyFix
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+if os.environ.get('COMPRESSION_ENABLED', '1') == '1':
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+        level=int(os.environ.get('COMPRESSION_LEVEL', '6')),
+        brotli_quality=int(os.environ.get('BROTLI_QUALITY', '4'))
+    )
+
 database_url = os.environ.get('DATABASE_URL')
 if database_url and database_url.startswith('postgres://'):
     database_url = database_url.replace('postgres://', 'postgresql://', 1)
@@ -26,10 +58,25 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+if database_url.startswith('postgresql'):
+    # Sized per worker so all gunicorn workers together stay under
+    # DB_MAX_CONNECTIONS (see serving.py).
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(serving.db_pool_options())
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(metrics.engine_options())
+
+replica_database_url = replica_url()
+if replica_database_url:
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: replica_database_url}
 
 db.init_app(app)
+metrics.init_metrics(app, db)
+if replica_database_url:
+    with app.app_context():
+        watch_replica(db.engines[REPLICA_BIND])
 csrf = CSRFProtect(app)
 
+register_commands(app)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -37,7 +84,7 @@ login_manager.login_message = 'Veuillez vous connecter pour accéder à cette pa
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 ADMIN_CODE = "1289"
 
@@ -49,86 +96,25 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def init_quests():
-    quests_data = [
-        {
-            "order": 1,
-            "title": "Suivre MrBeast sur YouTube",
-            "description": "Abonnez-vous à la chaîne YouTube de MrBeast",
-            "icon": "youtube",
-            "action_url": "https://www.youtube.com/@MrBeast",
-            "action_type": "subscribe"
-        },
-        {
-            "order": 2,
-            "title": "Inviter un ami",
-            "description": "Parrainez au moins une personne avec votre lien de parrainage",
-            "icon": "users",
-            "action_url": "",
-            "action_type": "referral"
-        },
-        {
-            "order": 3,
-            "title": "Rejoindre Telegram",
-            "description": "Rejoignez notre groupe Telegram",
-            "icon": "telegram",
-            "action_url": "https://t.me/mrbeast",
-            "action_type": "join"
-        },
-        {
-            "order": 4,
-            "title": "Suivre sur TikTok",
-            "description": "Suivez notre compte TikTok",
-            "icon": "tiktok",
-            "action_url": "https://www.tiktok.com/@mrbeast",
-            "action_type": "follow"
-        },
-    ]
-    
-    for quest_data in quests_data:
-        existing_quest = Quest.query.filter_by(order=quest_data["order"]).first()
-        if existing_quest:
-            existing_quest.title = quest_data["title"]
-            existing_quest.description = quest_data["description"]
-            existing_quest.icon = quest_data["icon"]
-            existing_quest.action_url = quest_data["action_url"]
-            existing_quest.action_type = quest_data["action_type"]
-        else:
-            new_quest = Quest(
-                title=quest_data["title"],
-                description=quest_data["description"],
-                icon=quest_data["icon"],
-                order=quest_data["order"],
-                action_url=quest_data["action_url"],
-                action_type=quest_data["action_type"]
-            )
-            db.session.add(new_quest)
-    db.session.commit()
-
-def create_admin():
-    admin = User.query.filter_by(email='admin@questmoney.com').first()
-    if not admin:
-        admin = User(username='Admin', email='admin@questmoney.com', is_admin=True)
-        admin.set_password('admin123')
-        db.session.add(admin)
-        db.session.commit()
-
-with app.app_context():
-    db.create_all()
-    init_quests()
-    create_admin()
-
 @app.context_processor
 def inject_csrf_token():
     return dict(csrf_token=generate_csrf)
 
+app.add_template_global(page_url)
+
+asset_manifest = AssetManifest(app.static_folder)
+app.add_template_global(asset_manifest.url, 'asset_url')
+
+def serve_static(filename):
+    return send_static(app.static_folder, filename, request.headers.get('Accept-Encoding', ''))
+
+app.view_functions['static'] = serve_static
+
 @app.route('/')
 def index():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
-    return render_template('index.html')
-
-REFERRAL_BONUS = 10.0
+    return page_cache.respond('index.html')
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -168,12 +154,17 @@ def register():
                 user.referred_by_id = referrer.id
         
         db.session.add(user)
+        db.session.flush()
+        referrals.record_signup(user.id, user.referred_by_id)
         db.session.commit()
         
         flash('Inscription réussie! Connectez-vous maintenant.', 'success')
         return redirect(url_for('login'))
     
-    return render_template('register.html', ref_code=ref_code)
+    if ref_code:
+        # Referral links carry the code in the page, so they bypass the cache.
+        return render_template('register.html', ref_code=ref_code)
+    return page_cache.respond('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -187,6 +178,9 @@ def login():
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             flash('Connexion réussie!', 'success')
             if user.is_admin:
@@ -195,7 +189,7 @@ def login():
         else:
             flash('Email ou mot de passe incorrect.', 'error')
     
-    return render_template('login.html')
+    return page_cache.respond('login.html')
 
 @app.route('/logout')
 @login_required
@@ -207,26 +201,11 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    from datetime import timedelta
-    
-    all_quests = Quest.query.all()
-    
     days_since_registration = (datetime.utcnow() - current_user.created_at).days if current_user.created_at else 0
+    quests = quest_catalog.visible_for(days_since_registration)
     
-    quests = []
-    for quest in all_quests:
-        if quest.action_type == 'referral':
-            if days_since_registration >= 2:
-                quests.append(quest)
-        else:
-            quests.append(quest)
-    
-    completed_today = current_user.get_completed_quests_today()
-    today_completions = QuestCompletion.query.filter(
-        QuestCompletion.user_id == current_user.id,
-        db.func.date(QuestCompletion.completed_at) == date.today()
-    ).all()
-    completed_quest_ids = [c.quest_id for c in today_completions]
+    completed_quest_ids = current_user.get_completed_quest_ids_today()
+    completed_today = len(completed_quest_ids)
     
     pending_transactions = Transaction.query.filter_by(
         user_id=current_user.id, 
@@ -239,6 +218,41 @@ def dashboard():
                          completed_quest_ids=completed_quest_ids,
                          pending_transactions=pending_transactions)
 
+@app.route('/api/dashboard')
+@login_required
+def api_dashboard():
+    # One primary-key read decides between a 304 and a full payload. The day
+    # is part of the ETag because completed quests reset at UTC midnight.
+    today = datetime.utcnow().date()
+    row = db.session.execute(
+        db.select(User.state_version, User.balance, User.referral_balance, User.deposit)
+        .where(User.id == current_user.id)
+    ).one()
+    etag = f'{current_user.id}-{row.state_version}-{today.isoformat()}'
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    activity = db.session.get(DailyActivity, (current_user.id, today))
+    completed_quest_ids = activity.quest_ids if activity else []
+    pending_transactions = Transaction.query.filter_by(
+        user_id=current_user.id,
+        status='pending'
+    ).count()
+    
+    response = jsonify({
+        'balance': row.balance or 0.0,
+        'referral_balance': row.referral_balance or 0.0,
+        'deposit': row.deposit or 0.0,
+        'quest_reward': (row.deposit or 0.0) * balance.QUEST_REWARD_RATE,
+        'completed_quest_ids': completed_quest_ids,
+        'completed_today': len(completed_quest_ids),
+        'pending_transactions': pending_transactions
+    })
+    response.set_etag(etag)
+    return response
+
 @app.route('/deposit', methods=['GET', 'POST'])
 @login_required
 def deposit():
@@ -253,17 +267,19 @@ def deposit():
             flash('Le minimum de dépôt est de 100$.', 'error')
             return redirect(url_for('deposit'))
         
-        if amount > current_user.balance:
-            flash('Solde insuffisant pour ce dépôt.', 'error')
+        try:
+            balance.move_to_deposit(current_user.id, amount)
+        except balance.BalanceError as e:
+            db.session.rollback()
+            flash(e.message, 'error')
             return redirect(url_for('deposit'))
         
-        current_user.deposit += amount
-        current_user.balance -= amount
         db.session.commit()
         flash(f'Dépôt de {amount:.2f}$ effectué avec succès!', 'success')
         return redirect(url_for('dashboard'))
     
-    user_transactions = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.created_at.desc()).limit(5).all()
+    with use_replica():
+        user_transactions = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.created_at.desc()).limit(5).all()
     return render_template('deposit.html', transactions=user_transactions)
 
 @app.route('/request_deposit', methods=['POST'])
@@ -289,6 +305,8 @@ def request_deposit():
         status='pending'
     )
     db.session.add(transaction)
+    stats.mark_dirty()
+    balance.bump_state_version([current_user.id])
     db.session.commit()
     
     flash('Demande de dépôt envoyée! En attente de validation.', 'success')
@@ -297,8 +315,6 @@ def request_deposit():
 @app.route('/request_withdrawal', methods=['POST'])
 @login_required
 def request_withdrawal():
-    DAILY_WITHDRAWAL_LIMIT = 150.0
-    
     try:
         amount = float(request.form.get('amount', 0))
     except (ValueError, TypeError):
@@ -316,35 +332,13 @@ def request_withdrawal():
         flash('Adresse de portefeuille requise.', 'error')
         return redirect(url_for('dashboard'))
     
-    if balance_type == 'referral_balance':
-        if amount > current_user.referral_balance:
-            flash('Solde de parrainage insuffisant.', 'error')
-            return redirect(url_for('dashboard'))
-        current_user.referral_balance -= amount
-    else:
-        if amount > current_user.balance:
-            flash('Solde insuffisant.', 'error')
-            return redirect(url_for('dashboard'))
-        
-        daily_total = current_user.get_daily_withdrawal_total()
-        if daily_total + amount > DAILY_WITHDRAWAL_LIMIT:
-            remaining = DAILY_WITHDRAWAL_LIMIT - daily_total
-            if remaining <= 0:
-                flash(f'Vous avez atteint la limite de retrait journalier de {DAILY_WITHDRAWAL_LIMIT:.2f}$.', 'error')
-            else:
-                flash(f'Ce retrait dépasse la limite journalière. Il vous reste {remaining:.2f}$ disponibles aujourd\'hui.', 'error')
-            return redirect(url_for('dashboard'))
-        current_user.balance -= amount
+    try:
+        balance.request_withdrawal(current_user.id, amount, wallet_address, balance_type)
+    except balance.BalanceError as e:
+        db.session.rollback()
+        flash(e.message, 'error')
+        return redirect(url_for('dashboard'))
     
-    transaction = Transaction(
-        user_id=current_user.id,
-        type='withdrawal',
-        amount=amount,
-        wallet_address=wallet_address,
-        balance_type=balance_type,
-        status='pending'
-    )
-    db.session.add(transaction)
     db.session.commit()
     
     flash('Demande de retrait envoyée! En attente de validation.', 'success')
@@ -363,7 +357,7 @@ def add_balance():
         flash('Montant invalide (max 10000$ en mode démo).', 'error')
         return redirect(url_for('deposit'))
     
-    current_user.balance += amount
+    balance.credit(current_user.id, amount)
     db.session.commit()
     flash(f'{amount:.2f}$ ajoutés à votre solde (mode démo).', 'success')
     return redirect(url_for('deposit'))
@@ -371,48 +365,27 @@ def add_balance():
 @app.route('/complete_quest/<int:quest_id>', methods=['POST'])
 @login_required
 def complete_quest(quest_id):
-    if not current_user.can_complete_quest():
-        return jsonify({'success': False, 'message': 'Vous avez déjà complété 4 quêtes aujourd\'hui ou vous n\'avez pas de dépôt.'})
-    
-    quest = Quest.query.get_or_404(quest_id)
-    
-    today_completion = QuestCompletion.query.filter(
-        QuestCompletion.user_id == current_user.id,
-        QuestCompletion.quest_id == quest_id,
-        db.func.date(QuestCompletion.completed_at) == date.today()
-    ).first()
-    
-    if today_completion:
-        return jsonify({'success': False, 'message': 'Vous avez déjà complété cette quête aujourd\'hui.'})
+    quest = quest_catalog.get(quest_id)
+    if quest is None:
+        abort(404)
     
     if quest.action_type == 'referral':
-        referrals_with_deposit = User.query.filter_by(referred_by_id=current_user.id).join(
-            Transaction, Transaction.user_id == User.id
-        ).filter(
-            Transaction.type == 'deposit',
-            Transaction.status == 'approved'
-        ).distinct().count()
-        
-        if referrals_with_deposit == 0:
+        if current_user.qualified_referral_count == 0:
             return jsonify({'success': False, 'message': 'Vous devez parrainer au moins une personne qui a effectué un dépôt validé pour compléter cette quête. Partagez votre lien de parrainage depuis votre profil!'})
     
-    reward = current_user.deposit * 0.5
-    
-    completion = QuestCompletion(
-        user_id=current_user.id,
-        quest_id=quest_id,
-        reward=reward
-    )
-    current_user.balance += reward
+    try:
+        reward, new_balance, completed_today = balance.complete_quest(current_user.id, quest_id)
+    except balance.BalanceError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': e.message})
     
-    db.session.add(completion)
     db.session.commit()
     
     return jsonify({
         'success': True, 
         'message': f'Quête complétée! Vous avez gagné {reward:.2f}$',
-        'new_balance': current_user.balance,
-        'completed_today': current_user.get_completed_quests_today()
+        'new_balance': new_balance,
+        'completed_today': completed_today
     })
 
 @app.route('/withdraw', methods=['POST'])
@@ -428,31 +401,47 @@ def withdraw():
         flash('Le montant doit être positif.', 'error')
         return redirect(url_for('dashboard'))
     
-    if amount > current_user.balance:
-        flash('Solde insuffisant.', 'error')
+    try:
+        balance.debit(current_user.id, amount)
+    except balance.BalanceError as e:
+        db.session.rollback()
+        flash(e.message, 'error')
         return redirect(url_for('dashboard'))
     
-    current_user.balance -= amount
     db.session.commit()
     flash(f'Retrait de {amount:.2f}$ effectué!', 'success')
     return redirect(url_for('dashboard'))
 
 @app.route('/history')
 @login_required
+@replica_reads
 def history():
-    completions = QuestCompletion.query.filter_by(user_id=current_user.id).order_by(QuestCompletion.completed_at.desc()).all()
-    transactions = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.created_at.desc()).all()
-    return render_template('history.html', completions=completions, transactions=transactions)
+    completions = keyset_paginate(
+        QuestCompletion.query.filter_by(user_id=current_user.id).options(
+            db.joinedload(QuestCompletion.quest).load_only(Quest.id, Quest.title)
+        ),
+        QuestCompletion.completed_at, QuestCompletion.id,
+        cursor=request.args.get('before')
+    )
+    # Months older than the rollup window (see rollup.py), newest first.
+    monthly_summaries = QuestCompletionMonth.query.filter_by(user_id=current_user.id).order_by(
+        QuestCompletionMonth.month.desc()
+    ).all()
+    total_earned = (db.session.query(db.func.sum(QuestCompletion.reward)).filter(
+        QuestCompletion.user_id == current_user.id
+    ).scalar() or 0.0) + sum(summary.total_reward for summary in monthly_summaries)
+    return render_template('history.html', completions=completions, total_earned=total_earned,
+                         monthly_summaries=monthly_summaries, quest_catalog=quest_catalog)
 
 @app.route('/profile')
 @login_required
+@replica_reads
 def profile():
-    referral_count = User.query.filter_by(referred_by_id=current_user.id).count()
     referral_link = request.host_url + 'register?ref=' + (current_user.referral_code or '')
     return render_template('profile.html', 
-                         referral_count=referral_count,
+                         referral_count=current_user.referral_count,
                          referral_link=referral_link,
-                         referral_bonus=REFERRAL_BONUS)
+                         referral_bonus=balance.REFERRAL_BONUS)
 
 @app.route('/change_password', methods=['POST'])
 @login_required
@@ -461,7 +450,8 @@ def change_password():
     new_password = request.form.get('new_password', '')
     confirm_password = request.form.get('confirm_password', '')
     
-    if not current_user.check_password(current_password):
+    user = load_db_user(current_user.id)
+    if not user.check_password(current_password):
         flash('Mot de passe actuel incorrect.', 'error')
         return redirect(url_for('profile'))
     
@@ -473,7 +463,7 @@ def change_password():
         flash('Les mots de passe ne correspondent pas.', 'error')
         return redirect(url_for('profile'))
     
-    current_user.set_password(new_password)
+    user.set_password(new_password)
     db.session.commit()
     flash('Mot de passe mis a jour avec succes!', 'success')
     return redirect(url_for('profile'))
@@ -504,25 +494,29 @@ def admin_logout():
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
-    pending_deposits = Transaction.query.filter_by(type='deposit', status='pending').count()
-    pending_withdrawals = Transaction.query.filter_by(type='withdrawal', status='pending').count()
-    total_users = User.query.filter_by(is_admin=False).count()
+    dashboard_stats = stats.admin_stats.get()
     
-    recent_transactions = Transaction.query.filter_by(status='pending').order_by(Transaction.created_at.desc()).limit(10).all()
+    recent_transactions = Transaction.query.filter_by(status='pending').options(
+        db.joinedload(Transaction.user).load_only(User.id, User.username)
+    ).order_by(Transaction.created_at.desc()).limit(10).all()
     
     return render_template('admin/dashboard.html',
-                         pending_deposits=pending_deposits,
-                         pending_withdrawals=pending_withdrawals,
-                         total_users=total_users,
+                         pending_deposits=dashboard_stats['pending_deposits'],
+                         pending_withdrawals=dashboard_stats['pending_withdrawals'],
+                         total_users=dashboard_stats['total_users'],
+                         stats=dashboard_stats,
                          recent_transactions=recent_transactions)
 
 @app.route('/admin/transactions')
 @admin_required
+@replica_reads
 def admin_transactions():
     status_filter = request.args.get('status', 'pending')
     type_filter = request.args.get('type', 'all')
     
-    query = Transaction.query
+    query = Transaction.query.options(
+        db.joinedload(Transaction.user).load_only(User.id, User.username)
+    )
     
     if status_filter != 'all':
         query = query.filter_by(status=status_filter)
@@ -530,7 +524,7 @@ def admin_transactions():
     if type_filter != 'all':
         query = query.filter_by(type=type_filter)
     
-    transactions = query.order_by(Transaction.created_at.desc()).all()
+    transactions = keyset_paginate(query, Transaction.created_at, Transaction.id, cursor=request.args.get('before'))
     
     return render_template('admin/transactions.html',
                          transactions=transactions,
@@ -540,38 +534,19 @@ def admin_transactions():
 @app.route('/admin/transaction/<int:tx_id>/approve', methods=['POST'])
 @admin_required
 def approve_transaction(tx_id):
-    transaction = Transaction.query.get_or_404(tx_id)
-    
-    if transaction.status != 'pending':
-        flash('Cette transaction a déjà été traitée.', 'error')
-        return redirect(url_for('admin_transactions'))
-    
-    transaction.status = 'approved'
-    transaction.processed_at = datetime.utcnow()
-    transaction.processed_by = current_user.id if current_user.is_authenticated else None
-    transaction.admin_note = request.form.get('note', '')
+    Transaction.query.get_or_404(tx_id)
     
-    user = User.query.get(transaction.user_id)
-    if not user:
-        flash('Utilisateur non trouvé pour cette transaction.', 'error')
+    try:
+        balance.approve_transaction(
+            tx_id,
+            processed_by=current_user.id if current_user.is_authenticated else None,
+            note=request.form.get('note', '')
+        )
+    except balance.BalanceError as e:
+        db.session.rollback()
+        flash(e.message, 'error')
         return redirect(url_for('admin_transactions'))
     
-    if transaction.type == 'deposit':
-        previous_approved_deposits = Transaction.query.filter(
-            Transaction.user_id == user.id, 
-            Transaction.type == 'deposit', 
-            Transaction.status == 'approved',
-            Transaction.id != transaction.id
-        ).count()
-        
-        user.balance += transaction.amount
-        
-        if previous_approved_deposits == 0 and user.referred_by_id:
-            referrer = User.query.get(user.referred_by_id)
-            if referrer:
-                referrer.referral_balance = (referrer.referral_balance or 0) + REFERRAL_BONUS
-                referrer.referral_bonus_earned = (referrer.referral_bonus_earned or 0) + REFERRAL_BONUS
-    
     db.session.commit()
     flash(f'Transaction #{tx_id} approuvée.', 'success')
     return redirect(url_for('admin_transactions'))
@@ -579,35 +554,124 @@ def approve_transaction(tx_id):
 @app.route('/admin/transaction/<int:tx_id>/reject', methods=['POST'])
 @admin_required
 def reject_transaction(tx_id):
-    transaction = Transaction.query.get_or_404(tx_id)
+    Transaction.query.get_or_404(tx_id)
     
-    if transaction.status != 'pending':
-        flash('Cette transaction a déjà été traitée.', 'error')
+    try:
+        balance.reject_transaction(
+            tx_id,
+            processed_by=current_user.id if current_user.is_authenticated else None,
+            note=request.form.get('note', '')
+        )
+    except balance.BalanceError as e:
+        db.session.rollback()
+        flash(e.message, 'error')
         return redirect(url_for('admin_transactions'))
     
-    transaction.status = 'rejected'
-    transaction.processed_at = datetime.utcnow()
-    transaction.processed_by = current_user.id if current_user.is_authenticated else None
-    transaction.admin_note = request.form.get('note', '')
+    db.session.commit()
+    flash(f'Transaction #{tx_id} rejetée.', 'success')
+    return redirect(url_for('admin_transactions'))
+
+BULK_TRANSACTION_LIMIT = 500
+
+@app.route('/admin/transactions/bulk', methods=['POST'])
+@admin_required
+def admin_bulk_transactions():
+    payload = request.get_json(silent=True) or {}
+    action = payload.get('action') or request.form.get('action', '')
+    raw_ids = payload.get('tx_ids') or request.form.getlist('tx_ids')
+    note = payload.get('note') or request.form.get('note', '')
     
-    if transaction.type == 'withdrawal':
-        user = User.query.get(transaction.user_id)
-        if user:
-            if transaction.balance_type == 'referral_balance':
-                user.referral_balance = (user.referral_balance or 0) + transaction.amount
-            else:
-                user.balance += transaction.amount
+    try:
+        tx_ids = [int(tx_id) for tx_id in raw_ids]
+    except (ValueError, TypeError):
+        tx_ids = []
+    
+    if action not in ('approve', 'reject') or not tx_ids or len(tx_ids) > BULK_TRANSACTION_LIMIT:
+        message = f'Sélectionnez entre 1 et {BULK_TRANSACTION_LIMIT} transactions et une action valide.'
+        if request.is_json:
+            return jsonify({'success': False, 'message': message}), 400
+        flash(message, 'error')
+        return redirect(url_for('admin_transactions'))
     
+    processed_by = current_user.id if current_user.is_authenticated else None
+    if action == 'approve':
+        results = balance.approve_transactions(tx_ids, processed_by=processed_by, note=note)
+    else:
+        results = balance.reject_transactions(tx_ids, processed_by=processed_by, note=note)
     db.session.commit()
-    flash(f'Transaction #{tx_id} rejetée.', 'success')
+    
+    summary = {}
+    for outcome in results.values():
+        summary[outcome] = summary.get(outcome, 0) + 1
+    
+    if request.is_json:
+        return jsonify({
+            'success': True,
+            'action': action,
+            'results': {str(tx_id): outcome for tx_id, outcome in results.items()},
+            'summary': summary
+        })
+    
+    done = summary.get('approved', 0) + summary.get('rejected', 0)
+    skipped = len(results) - done
+    verb = 'approuvée(s)' if action == 'approve' else 'rejetée(s)'
+    flash(f'{done} transaction(s) {verb}.' + (f' {skipped} ignorée(s) (déjà traitée(s) ou introuvable(s)).' if skipped else ''), 'success')
     return redirect(url_for('admin_transactions'))
 
+@app.route('/admin/export/<kind>')
+@admin_required
+def admin_export(kind):
+    if kind not in exports.EXPORTS:
+        abort(404)
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = exports.stream_export(
+            kind, fmt,
+            status=request.args.get('status'),
+            tx_type=request.args.get('type'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
+    except exports.ExportError as e:
+        return jsonify({'success': False, 'message': e.message}), 400
+    
+    return Response(chunks, content_type=exports.FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{exports.export_filename(kind, fmt)}"',
+        'Cache-Control': 'no-store',
+    })
+
+@app.route('/admin/cache_stats')
+@admin_required
+def admin_cache_stats():
+    return jsonify({'user_cache': user_cache.stats()})
+
 @app.route('/admin/users')
 @admin_required
+@replica_reads
 def admin_users():
-    users = User.query.filter_by(is_admin=False).order_by(User.created_at.desc()).all()
+    users = keyset_paginate(
+        User.query.filter_by(is_admin=False),
+        User.created_at, User.id,
+        cursor=request.args.get('before')
+    )
     return render_template('admin/users.html', users=users)
 
+@app.route('/admin/referrals')
+@admin_required
+@replica_reads
+def admin_referrals():
+    query = request.args.get('user', '').strip()
+    max_depth = request.args.get('max_depth', type=int)
+    user = referrals.find_user(query) if query else None
+    levels = referrals.downline_by_depth(user.id, max_depth) if user else []
+    return render_template('admin/referrals.html',
+                         query=query,
+                         user=user,
+                         max_depth=max_depth,
+                         levels=levels,
+                         totals=referrals.downline_totals(levels),
+                         upline=referrals.upline(user.id) if user else [])
+
 @app.route('/admin/user/<int:user_id>/add_balance', methods=['POST'])
 @admin_required
 def admin_add_balance(user_id):
@@ -618,7 +682,7 @@ def admin_add_balance(user_id):
         flash('Montant invalide.', 'error')
         return redirect(url_for('admin_users'))
     
-    user.balance += amount
+    balance.credit(user.id, amount)
     db.session.commit()
     flash(f'{amount:.2f}$ ajoutés au compte de {user.username}.', 'success')
     return redirect(url_for('admin_users'))
@@ -649,10 +713,10 @@ def admin_quick_add_balance():
         return redirect(url_for('admin_dashboard'))
     
     if add_type == 'deposit':
-        user.deposit += amount
+        balance.credit(user.id, amount, 'deposit')
         flash(f'{amount:.2f}$ ajoutés au dépôt actif de {user.username}.', 'success')
     else:
-        user.balance += amount
+        balance.credit(user.id, amount)
         flash(f'{amount:.2f}$ ajoutés au solde de {user.username}.', 'success')
     
     db.session.commit()
@@ -660,23 +724,67 @@ def admin_quick_add_balance():
 
 @app.route('/offline')
 def offline():
-    return render_template('offline.html')
+    return page_cache.respond('offline.html')
+
+@app.route('/csrf-token')
+def csrf_token_value():
+    # Cached anonymous pages are served without a token; forms fetch one here.
+    return jsonify({'csrf_token': generate_csrf()})
+
+EXTERNAL_STYLESHEETS = (
+    'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800;900&display=swap',
+    'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css',
+)
 
 @app.route('/service-worker.js')
 def service_worker():
-    from flask import send_from_directory
-    return send_from_directory('static', 'service-worker.js', mimetype='application/javascript')
+    script = asset_manifest.service_worker_script([url_for('offline'), *EXTERNAL_STYLESHEETS])
+    response = app.response_class(script, mimetype='application/javascript')
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return metrics.render_metrics()
+
+@app.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(error):
+    db.session.rollback()
+    flash('Trop de connexions en cours, veuillez réessayer dans un instant.', 'error')
+    response = redirect(request.path)
+    response.headers['Retry-After'] = '5'
+    return response
 
 @app.after_request
 def add_header(response):
     if 'service-worker.js' in request.path:
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        # Revalidated on every update check; unchanged workers get a 304.
+        response.headers['Cache-Control'] = 'no-cache'
         response.headers['Service-Worker-Allowed'] = '/'
-    else:
+        return response
+    elif response.status_code in (200, 304) and asset_manifest.is_fingerprinted(request.path, app.static_url_path):
+        # A 404 marked immutable would outlive the deploy that adds the file.
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+    elif request.endpoint == 'static':
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    elif 'Cache-Control' in response.headers:
+        # Set by the view itself (cached anonymous pages).
+        return response
+    elif current_user.is_authenticated or session.get('admin_access') or response.is_json:
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     return response
 
+if os.environ.get('PRELOAD_TEMPLATES', '1') == '1':
+    precompile_templates(app)
+
 if __name__ == '__main__':
+    with app.app_context():
+        bootstrap()
     app.run(host='0.0.0.0', port=5000, debug=True)
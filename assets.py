@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+from flask import url_for
+from compression import precompress
+
+# Static asset fingerprinting. `flask build-assets` copies each file under
+# static/ to static/dist/ with a content hash in its name and records the
+# mapping in static/dist/assets-manifest.json, next to precompressed .gz/.br
+# siblings of each text asset. Templates call asset_url(), which
+# returns the fingerprinted URL when the manifest knows the file; those URLs
+# never change content, so they are served with a one-year immutable
+# Cache-Control. Without a build, asset_url() falls back to the plain
+# /static/ URL, which browsers revalidate.
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'assets-manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Files whose URL must stay stable: the PWA manifest is referenced by its
+# path, and the service worker is served from /service-worker.js.
+STABLE_ASSETS = ('manifest.json', 'service-worker.js')
+
+# Precached by the service worker at install time, in addition to the
+# offline page and the external stylesheets passed in by the route.
+SERVICE_WORKER_PRECACHE = (
+    'style.css', 'script.js', 'manifest.json',
+    'icons/icon-192x192.svg', 'icons/icon-512x512.svg',
+)
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+def _source_files(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder)
+        if rel_root == DIST_DIR or rel_root.startswith(DIST_DIR + os.sep):
+            dirs[:] = []
+            continue
+        for name in sorted(files):
+            rel_path = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/')
+            if rel_path in STABLE_ASSETS:
+                continue
+            yield rel_path
+
+def build_assets(static_folder):
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for rel_path in _source_files(static_folder):
+        source = os.path.join(static_folder, rel_path)
+        stem, ext = os.path.splitext(rel_path)
+        hashed = f'{stem}.{_fingerprint(source)}{ext}'
+        target = os.path.join(dist_folder, hashed)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+        precompress(target)
+        manifest[rel_path] = f'{DIST_DIR}/{hashed}'
+
+    # Older fingerprinted files are kept so pages rendered before a deploy
+    # can still load their assets.
+    manifest_path = os.path.join(dist_folder, MANIFEST_NAME)
+    os.makedirs(dist_folder, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+class AssetManifest:
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.entries = {}
+        self._fingerprinted = frozenset()
+        self.reload()
+
+    def reload(self):
+        self._service_worker = None
+        path = os.path.join(self.static_folder, DIST_DIR, MANIFEST_NAME)
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self._fingerprinted = frozenset(self.entries.values())
+
+    def url(self, filename):
+        return url_for('static', filename=self.entries.get(filename, filename))
+
+    def is_fingerprinted(self, request_path, static_url_path):
+        # Only files the current manifest points to; anything else under
+        # dist/ (a mistyped or not yet deployed hash) must not be cached.
+        prefix = f'{static_url_path}/'
+        return request_path.startswith(prefix) and request_path[len(prefix):] in self._fingerprinted
+
+    def service_worker_script(self, extra_urls=()):
+        # The cache name is derived from the precached URLs (which carry the
+        # content hashes) and the worker source, so any asset change installs
+        # a new worker with a fresh cache and drops the old one.
+        urls = [self.url(name) for name in SERVICE_WORKER_PRECACHE] + list(extra_urls)
+        cached = self._service_worker
+        if cached is not None and cached[0] == urls:
+            return cached[1]
+
+        with open(os.path.join(self.static_folder, 'service-worker.js')) as f:
+            source = f.read()
+        version = hashlib.sha256((json.dumps(urls) + source).encode()).hexdigest()[:HASH_LENGTH]
+        config = {
+            'cacheName': f'questmoney-{version}',
+            'precacheUrls': urls,
+            'immutablePrefix': url_for('static', filename=DIST_DIR + '/'),
+        }
+        script = f'self.SW_CONFIG = {json.dumps(config)};\n{source}'
+        self._service_worker = (urls, script)
+        return script
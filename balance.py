@@ -0,0 +1,237 @@
+from datetime import datetime
+from models import db, User, QuestCompletion, Transaction, DailyActivity, DAILY_QUEST_LIMIT, DAILY_WITHDRAWAL_LIMIT, insert_ignore
+from usercache import invalidate_on_commit
+import referrals
+import stats
+
+# Every change to a user's money goes through this module. Balances are
+# never read into Python, modified and written back: each change is a single
+# UPDATE ... SET column = column + :delta guarded by a WHERE clause and
+# returning the new values, so concurrent workers cannot lose updates. Daily
+# limits are checked while holding the row lock on the user's DailyActivity.
+# Callers own the transaction and must commit (or roll back on BalanceError).
+
+REFERRAL_BONUS = 10.0
+QUEST_REWARD_RATE = 0.5
+
+BALANCE_COLUMNS = ('balance', 'deposit', 'referral_balance', 'referral_bonus_earned')
+
+class BalanceError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+class InsufficientFunds(BalanceError):
+    pass
+
+class DailyLimitReached(BalanceError):
+    pass
+
+class AlreadyProcessed(BalanceError):
+    pass
+
+def adjust(user_id, guard=None, **deltas):
+    values = {}
+    for name, delta in deltas.items():
+        if name not in BALANCE_COLUMNS:
+            raise ValueError(f'Unknown balance column: {name}')
+        column = getattr(User, name)
+        values[name] = db.func.coalesce(column, 0.0) + delta
+    values['state_version'] = User.state_version + 1
+
+    stmt = db.update(User).where(User.id == user_id).values(values).returning(
+        *(getattr(User, name) for name in BALANCE_COLUMNS)
+    )
+    if guard is not None:
+        stmt = stmt.where(guard)
+    row = db.session.execute(stmt, execution_options={'synchronize_session': False}).first()
+    if row is None:
+        return None
+    invalidate_on_commit(user_id)
+    return {name: float(value or 0.0) for name, value in row._asdict().items()}
+
+def credit(user_id, amount, column='balance'):
+    return adjust(user_id, **{column: amount})
+
+def debit(user_id, amount, column='balance'):
+    result = adjust(user_id, guard=db.func.coalesce(getattr(User, column), 0.0) >= amount, **{column: -amount})
+    if result is None:
+        raise InsufficientFunds('Solde insuffisant.')
+    return result
+
+def lock_daily_activity(user_id):
+    today = datetime.utcnow().date()
+    query = db.select(DailyActivity).filter_by(user_id=user_id, day=today).with_for_update().execution_options(populate_existing=True)
+    activity = db.session.execute(query).scalar_one_or_none()
+    if activity is None:
+        insert_ignore(DailyActivity, user_id=user_id, day=today, quests_completed=0,
+                      completed_quest_ids='', balance_withdrawn=0.0)
+        activity = db.session.execute(query).scalar_one()
+    return activity
+
+def complete_quest(user_id, quest_id):
+    activity = lock_daily_activity(user_id)
+    if activity.quests_completed >= DAILY_QUEST_LIMIT:
+        raise DailyLimitReached('Vous avez déjà complété 4 quêtes aujourd\'hui ou vous n\'avez pas de dépôt.')
+    if quest_id in activity.quest_ids:
+        raise DailyLimitReached('Vous avez déjà complété cette quête aujourd\'hui.')
+
+    result = adjust(user_id, guard=User.deposit > 0, balance=User.deposit * QUEST_REWARD_RATE)
+    if result is None:
+        raise InsufficientFunds('Vous avez déjà complété 4 quêtes aujourd\'hui ou vous n\'avez pas de dépôt.')
+
+    reward = result['deposit'] * QUEST_REWARD_RATE
+    activity.record_quest(quest_id)
+    db.session.add(QuestCompletion(user_id=user_id, quest_id=quest_id, reward=reward))
+    return reward, result['balance'], activity.quests_completed
+
+def move_to_deposit(user_id, amount):
+    result = adjust(user_id, guard=db.func.coalesce(User.balance, 0.0) >= amount, balance=-amount, deposit=amount)
+    if result is None:
+        raise InsufficientFunds('Solde insuffisant pour ce dépôt.')
+    return result
+
+def request_withdrawal(user_id, amount, wallet_address, balance_type):
+    if balance_type == 'referral_balance':
+        try:
+            debit(user_id, amount, 'referral_balance')
+        except InsufficientFunds:
+            raise InsufficientFunds('Solde de parrainage insuffisant.')
+    else:
+        balance_type = 'balance'
+        activity = lock_daily_activity(user_id)
+        daily_total = activity.balance_withdrawn or 0.0
+        if daily_total + amount > DAILY_WITHDRAWAL_LIMIT:
+            remaining = DAILY_WITHDRAWAL_LIMIT - daily_total
+            if remaining <= 0:
+                raise DailyLimitReached(f'Vous avez atteint la limite de retrait journalier de {DAILY_WITHDRAWAL_LIMIT:.2f}$.')
+            raise DailyLimitReached(f'Ce retrait dépasse la limite journalière. Il vous reste {remaining:.2f}$ disponibles aujourd\'hui.')
+        debit(user_id, amount, 'balance')
+        activity.record_withdrawal(amount)
+
+    transaction = Transaction(
+        user_id=user_id,
+        type='withdrawal',
+        amount=amount,
+        wallet_address=wallet_address,
+        balance_type=balance_type,
+        status='pending'
+    )
+    db.session.add(transaction)
+    stats.mark_dirty()
+    return transaction
+
+def bump_state_version(user_ids):
+    # For changes that move no money but still show on the dashboard, such
+    # as a new or rejected pending transaction.
+    user_ids = list(set(user_ids))
+    if user_ids:
+        db.session.execute(
+            db.update(User).where(User.id.in_(user_ids)).values(state_version=User.state_version + 1),
+            execution_options={'synchronize_session': False}
+        )
+
+def adjust_many(deltas_by_user, *columns):
+    # Set-based variant of adjust(): one UPDATE adds each user's own delta to
+    # the given columns, via CASE user.id WHEN ... THEN delta.
+    if not deltas_by_user:
+        return
+    for name in columns:
+        if name not in BALANCE_COLUMNS:
+            raise ValueError(f'Unknown balance column: {name}')
+    delta = db.case(deltas_by_user, value=User.id, else_=0.0)
+    values = {name: db.func.coalesce(getattr(User, name), 0.0) + delta for name in columns}
+    values['state_version'] = User.state_version + 1
+    db.session.execute(
+        db.update(User).where(User.id.in_(list(deltas_by_user))).values(values),
+        execution_options={'synchronize_session': False}
+    )
+    for user_id in deltas_by_user:
+        invalidate_on_commit(user_id)
+
+def _claim_pending(tx_ids, status, processed_by, note):
+    # The status guard makes approve/reject idempotent across workers: only
+    # the first request to flip a pending transaction gets its row back.
+    stmt = db.update(Transaction).where(
+        Transaction.id.in_(tx_ids),
+        Transaction.status == 'pending'
+    ).values(
+        status=status,
+        processed_at=datetime.utcnow(),
+        processed_by=processed_by,
+        admin_note=note
+    ).returning(Transaction.id, Transaction.user_id, Transaction.type, Transaction.amount, Transaction.balance_type)
+    rows = db.session.execute(stmt, execution_options={'synchronize_session': False}).all()
+    if rows:
+        stats.mark_dirty()
+        bump_state_version(row.user_id for row in rows)
+    return rows
+
+def _results(tx_ids, claimed, status):
+    results = {tx_id: status for tx_id in claimed}
+    missing = [tx_id for tx_id in tx_ids if tx_id not in results]
+    if missing:
+        existing = set(db.session.execute(
+            db.select(Transaction.id).where(Transaction.id.in_(missing))
+        ).scalars())
+        for tx_id in missing:
+            results[tx_id] = 'already_processed' if tx_id in existing else 'not_found'
+    return results
+
+def _sum_by(rows, key):
+    totals = {}
+    for row in rows:
+        totals[key(row)] = totals.get(key(row), 0.0) + row.amount
+    return totals
+
+def approve_transactions(tx_ids, processed_by=None, note=''):
+    tx_ids = list(dict.fromkeys(tx_ids))
+    claimed = _claim_pending(tx_ids, 'approved', processed_by, note)
+    deposits = [tx for tx in claimed if tx.type == 'deposit']
+    if deposits:
+        # Crediting first takes the users' row locks, so a concurrent approval
+        # of another deposit for the same user waits here and then sees this
+        # batch when it looks for previous approvals.
+        credits = _sum_by(deposits, lambda tx: tx.user_id)
+        adjust_many(credits, 'balance')
+
+        # Referral bonus, and a qualified referral for the referrer, for every
+        # user whose first approved deposit is in this batch, found in one query.
+        batch_ids = [tx.id for tx in deposits]
+        previous_deposit = db.select(Transaction.id).where(
+            Transaction.user_id == User.id,
+            Transaction.type == 'deposit',
+            Transaction.status == 'approved',
+            Transaction.id.notin_(batch_ids)
+        ).exists()
+        referrers = db.session.execute(
+            db.select(User.referred_by_id).where(
+                User.id.in_(list(credits)),
+                User.referred_by_id.isnot(None),
+                ~previous_deposit
+            )
+        ).scalars().all()
+        bonuses = {}
+        for referrer_id in referrers:
+            bonuses[referrer_id] = bonuses.get(referrer_id, 0.0) + REFERRAL_BONUS
+        adjust_many(bonuses, 'referral_balance', 'referral_bonus_earned')
+        referrals.record_qualified(referrers)
+    return _results(tx_ids, {tx.id for tx in claimed}, 'approved')
+
+def reject_transactions(tx_ids, processed_by=None, note=''):
+    tx_ids = list(dict.fromkeys(tx_ids))
+    claimed = _claim_pending(tx_ids, 'rejected', processed_by, note)
+    withdrawals = [tx for tx in claimed if tx.type == 'withdrawal']
+    refunds = [tx for tx in withdrawals if tx.balance_type != 'referral_balance']
+    referral_refunds = [tx for tx in withdrawals if tx.balance_type == 'referral_balance']
+    adjust_many(_sum_by(refunds, lambda tx: tx.user_id), 'balance')
+    adjust_many(_sum_by(referral_refunds, lambda tx: tx.user_id), 'referral_balance')
+    return _results(tx_ids, {tx.id for tx in claimed}, 'rejected')
+
+def approve_transaction(tx_id, processed_by=None, note=''):
+    if approve_transactions([tx_id], processed_by, note)[tx_id] != 'approved':
+        raise AlreadyProcessed('Cette transaction a déjà été traitée.')
+
+def reject_transaction(tx_id, processed_by=None, note=''):
+    if reject_transactions([tx_id], processed_by, note)[tx_id] != 'rejected':
+        raise AlreadyProcessed('Cette transaction a déjà été traitée.')
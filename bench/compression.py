@@ -0,0 +1,94 @@
+"""CPU cost versus bytes saved when compressing QuestMoney responses.
+
+Renders real pages through the test client (index, login, profile, history,
+admin tables) against a throwaway SQLite database, then times gzip at
+several levels (and brotli when installed) on each body and on style.css.
+
+    python bench/compression.py [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GZIP_LEVELS = (1, 4, 6, 9)
+BROTLI_QUALITIES = (1, 4, 6, 11)
+
+def _boot():
+    # Always a fresh SQLite file: the seed below would otherwise land in
+    # whatever DATABASE_URL (or replica) the shell points at.
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.pop('DATABASE_REPLICA_URL', None)
+    os.environ['COMPRESSION_ENABLED'] = '0'
+    from app import app
+    from commands import bootstrap
+    from models import db, User, Transaction, QuestCompletion
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        bootstrap()
+        user = User(username='bench', email='bench@example.com', deposit=200.0, balance=500.0)
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.flush()
+        for i in range(60):
+            db.session.add(User(username=f'user{i}', email=f'user{i}@example.com', password_hash='x', referred_by_id=user.id))
+            db.session.add(Transaction(user_id=user.id, type='deposit' if i % 2 else 'withdrawal', amount=100 + i,
+                                       status='pending', wallet_address='0x' + 'ab' * 20, tx_hash='0x' + 'cd' * 32))
+            db.session.add(QuestCompletion(user_id=user.id, quest_id=1 + i % 4, reward=100.0))
+        db.session.commit()
+    return app
+
+def _pages(app):
+    client = app.test_client()
+    pages = {'index.html': client.get('/').data, 'login.html': client.get('/login').data}
+    client.post('/login', data={'email': 'bench@example.com', 'password': 'bench-password'})
+    pages['profile.html'] = client.get('/profile').data
+    pages['history.html'] = client.get('/history').data
+    client.post('/admin/login', data={'code': '1289'})
+    pages['admin/transactions.html'] = client.get('/admin/transactions?status=all&type=all').data
+    pages['admin/users.html'] = client.get('/admin/users').data
+    with open(os.path.join(ROOT, 'static', 'style.css'), 'rb') as f:
+        pages['static/style.css'] = f.read()
+    return pages
+
+def _gzip(level):
+    def compress(body):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    return compress
+
+def _measure(compress, body, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = compress(body)
+    elapsed = (time.perf_counter() - start) / repeat
+    return len(out), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    codecs = [(f'gzip-{level}', _gzip(level)) for level in GZIP_LEVELS]
+    try:
+        import brotli
+        codecs += [(f'br-{quality}', lambda body, q=quality: brotli.compress(body, quality=q)) for quality in BROTLI_QUALITIES]
+    except ImportError:
+        print('brotli not installed: gzip only\n')
+
+    pages = _pages(_boot())
+    print(f'{"body":<26}{"codec":<9}{"bytes":>9}{"ratio":>8}{"ms/op":>9}{"MB/s":>9}')
+    for name, body in pages.items():
+        print(f'{name:<26}{"raw":<9}{len(body):>9}')
+        for codec, compress in codecs:
+            size, seconds = _measure(compress, body, args.repeat)
+            print(f'{"":<26}{codec:<9}{size:>9}{size / len(body):>8.3f}{seconds * 1000:>9.3f}{len(body) / seconds / 1e6:>9.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,520 @@
+"""Load test of the hot endpoints with per-endpoint latency and SQL counts.
+
+Boots the app in-process against a throwaway SQLite database, or the
+database given with --database-url (a local Postgres); seeds users with
+deposits, referrals and history; then drives them from concurrent threads,
+each request going through the Flask test client so SQL statements can be
+attributed to it. DATABASE_URL from the environment is ignored, since on a
+deployment it is the production database; --database-url refuses a
+database that already has users unless --force is given.
+
+Scenarios:
+  mixed     weighted mix of user pages, quest completions, withdrawals and
+            admin pages for --duration seconds
+  midnight  every user completes all of today's quests at once, the burst
+            that follows the daily reset
+  gunicorn  starts `gunicorn -c gunicorn.conf.py main:app` on the seeded
+            database once per worker class (--worker-classes) and drives
+            the cached landing page, /api/dashboard and /dashboard over HTTP
+            for --duration seconds each; worker counts and pools follow
+            serving.py, as in production
+
+Before the scenario, every view in querycount.VIEW_QUERY_BUDGETS is
+requested with a cold and a warm session-user cache and checked against its
+SQL statement budget; the script exits with status 1 if one is exceeded.
+--budgets-only stops after that check.
+
+For each endpoint it prints throughput, p50/p95/p99 latency and SQL
+statements per request; --json writes the same figures with the commit and
+settings, and --compare diffs against an earlier --json file.
+
+    python bench/load.py [--scenario mixed] [--users 200] [--concurrency 8]
+                         [--duration 20] [--json out.json] [--compare base.json]
+                         [--database-url postgresql://localhost/bench [--force]]
+    python bench/load.py --budgets-only --users 20
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_PASSWORD = 'bench-password'
+
+# (endpoint, weight) for the mixed scenario.
+MIXED_WEIGHTS = (
+    ('dashboard', 30),
+    ('api_dashboard', 25),
+    ('history', 10),
+    ('complete_quest', 15),
+    ('request_withdrawal', 5),
+    ('admin_dashboard', 5),
+    ('admin_transactions', 5),
+    ('admin_users', 5),
+)
+ADMIN_ENDPOINTS = ('admin_dashboard', 'admin_transactions', 'admin_users')
+
+# (endpoint, path, logged in) driven over HTTP by the gunicorn scenario.
+HTTP_ENDPOINTS = (
+    ('index', '/', False),
+    ('api_dashboard', '/api/dashboard', True),
+    ('dashboard', '/dashboard', True),
+)
+GUNICORN_START_TIMEOUT = 30
+
+# URL rendering each view that has a budget in VIEW_QUERY_BUDGETS.
+BUDGET_URLS = {
+    'history': '/history',
+    'admin_dashboard': '/admin',
+    'admin_transactions': '/admin/transactions',
+}
+
+def _boot(database_url=None, force=False):
+    if not database_url:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.pop('DATABASE_REPLICA_URL', None)
+    os.environ.setdefault('COMPRESSION_ENABLED', '0')
+    from app import app
+    app.config['WTF_CSRF_ENABLED'] = False
+    if not force:
+        _refuse_populated(app)
+    return app
+
+def _refuse_populated(app):
+    from sqlalchemy import inspect
+    from models import db, User
+    with app.app_context():
+        if inspect(db.engine).has_table(User.__tablename__) and db.session.scalar(
+                db.select(db.select(User.id).exists())):
+            sys.exit(f'{db.engine.url.render_as_string(hide_password=True)} already has users; '
+                     'pass --force to seed the benchmark users into it anyway.')
+
+def _seed(app, users, history):
+    from commands import bootstrap
+    from models import db, User, Transaction, QuestCompletion, Quest
+    from passwords import password_hasher
+    from referrals import backfill_referral_tree
+    with app.app_context():
+        bootstrap()
+        password_hash = password_hasher.hash(BENCH_PASSWORD)
+        created_at = datetime.utcnow() - timedelta(days=30)
+        run = format(int(time.time()) % 36 ** 4, 'x')
+        rows = [{
+            'username': f'bench-{run}-{i}',
+            'email': f'bench-{run}-{i}@example.com',
+            'password_hash': password_hash,
+            'referral_code': f'b{run}{i}'[:10],
+            'deposit': 200.0,
+            'balance': 1000.0,
+            'referral_balance': 10.0,
+            'referral_count': 1 if i < users - 1 else 0,
+            'qualified_referral_count': 1 if i < users - 1 else 0,
+            'created_at': created_at,
+        } for i in range(users)]
+        user_ids = db.session.scalars(db.insert(User).returning(User.id, sort_by_parameter_order=True), rows).all()
+        # Each user referred the next one, so every user can do the referral quest.
+        db.session.execute(db.update(User), [
+            {'id': user_id, 'referred_by_id': referrer_id}
+            for referrer_id, user_id in zip(user_ids, user_ids[1:])
+        ])
+        quest_ids = [quest.id for quest in Quest.query.order_by(Quest.order)]
+        transactions, completions = [], []
+        for user_id in user_ids:
+            transactions.append({'user_id': user_id, 'type': 'deposit', 'amount': 200.0, 'status': 'approved',
+                                 'tx_hash': f'0x{user_id:064x}', 'created_at': created_at})
+            for j in range(history):
+                transactions.append({'user_id': user_id, 'type': 'withdrawal', 'amount': 10.0,
+                                     'status': 'pending' if j % 3 else 'approved', 'wallet_address': '0x' + 'ab' * 20,
+                                     'balance_type': 'balance', 'created_at': created_at + timedelta(hours=j)})
+                completions.append({'user_id': user_id, 'quest_id': quest_ids[j % len(quest_ids)], 'reward': 100.0,
+                                    'completed_at': created_at + timedelta(hours=j)})
+        db.session.execute(db.insert(Transaction), transactions)
+        if completions:
+            db.session.execute(db.insert(QuestCompletion), completions)
+        db.session.commit()
+        backfill_referral_tree()
+        return user_ids, quest_ids
+
+def check_budgets(app, user_id):
+    # Returns the error messages of the views over budget.
+    from querycount import VIEW_QUERY_BUDGETS, assert_view_within_budget
+    from usercache import user_cache
+    with app.app_context():
+        from models import db
+        engine = db.engine
+    failures = []
+    for endpoint, budget in VIEW_QUERY_BUDGETS.items():
+        client = _client(app, user_id, admin=endpoint in ADMIN_ENDPOINTS)
+        for cache in ('cold', 'warm'):
+            if cache == 'cold':
+                user_cache.clear()
+            try:
+                assert_view_within_budget(client, BUDGET_URLS[endpoint], endpoint, engine)
+            except AssertionError as e:
+                failures.append(f'{endpoint} ({cache} user cache): {e}')
+                print(f'budget {endpoint:<20} {cache:<5} FAIL (max {budget})')
+            else:
+                print(f'budget {endpoint:<20} {cache:<5} ok (max {budget})')
+    return failures
+
+class SqlCounter:
+    # Requests run in the calling thread with the test client, so a
+    # thread-local counter attributes each statement to its request.
+    def __init__(self, engine):
+        self._local = threading.local()
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, statements, ok):
+        with self._lock:
+            self.samples[endpoint].append((seconds, statements))
+            if not ok:
+                self.errors[endpoint] += 1
+
+def _client(app, user_id, admin=False):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+        if admin:
+            session['admin_access'] = True
+    return client
+
+def _request(client, endpoint, quest_ids, rng):
+    if endpoint == 'dashboard':
+        return client.get('/dashboard')
+    if endpoint == 'api_dashboard':
+        return client.get('/api/dashboard')
+    if endpoint == 'history':
+        return client.get('/history')
+    if endpoint == 'complete_quest':
+        return client.post(f'/complete_quest/{rng.choice(quest_ids)}', json={})
+    if endpoint == 'request_withdrawal':
+        return client.post('/request_withdrawal', data={'amount': '5', 'wallet_address': '0x' + 'ef' * 20,
+                                                        'balance_type': 'balance'})
+    if endpoint == 'admin_dashboard':
+        return client.get('/admin')
+    if endpoint == 'admin_transactions':
+        return client.get('/admin/transactions')
+    if endpoint == 'admin_users':
+        return client.get('/admin/users')
+    raise ValueError(endpoint)
+
+def _timed(recorder, counter, client, endpoint, quest_ids, rng):
+    counter.reset()
+    start = time.perf_counter()
+    try:
+        response = _request(client, endpoint, quest_ids, rng)
+        ok = response.status_code < 400
+    except Exception:
+        ok = False
+    recorder.add(endpoint, time.perf_counter() - start, counter.count, ok)
+
+def run_mixed(app, user_ids, quest_ids, counter, args):
+    recorder = Recorder()
+    endpoints = [name for name, _ in MIXED_WEIGHTS]
+    weights = [weight for _, weight in MIXED_WEIGHTS]
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        rng = random.Random(args.seed + index)
+        clients = {}
+        while time.monotonic() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            user_id = rng.choice(user_ids)
+            admin = endpoint in ADMIN_ENDPOINTS
+            key = (user_id, admin)
+            if key not in clients:
+                clients[key] = _client(app, user_id, admin)
+            _timed(recorder, counter, clients[key], endpoint, quest_ids, rng)
+
+    return recorder, _run_threads(worker, args.concurrency)
+
+def run_midnight(app, user_ids, quest_ids, counter, args):
+    recorder = Recorder()
+    pending = list(user_ids)
+    random.Random(args.seed).shuffle(pending)
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(args.seed + index)
+        while True:
+            with lock:
+                if not pending:
+                    return
+                user_id = pending.pop()
+            client = _client(app, user_id)
+            _timed(recorder, counter, client, 'dashboard', quest_ids, rng)
+            for quest_id in quest_ids:
+                counter.reset()
+                start = time.perf_counter()
+                try:
+                    ok = client.post(f'/complete_quest/{quest_id}', json={}).status_code < 400
+                except Exception:
+                    ok = False
+                recorder.add('complete_quest', time.perf_counter() - start, counter.count, ok)
+
+    return recorder, _run_threads(worker, args.concurrency)
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def _session_cookies(app, user_ids):
+    # Signed the way Flask-Login's session is, with the secret key handed to
+    # gunicorn, so no login round trip is needed.
+    serializer = app.session_interface.get_signing_serializer(app)
+    name = app.config['SESSION_COOKIE_NAME']
+    return [f'{name}={serializer.dumps({"_user_id": str(user_id), "_fresh": True})}' for user_id in user_ids]
+
+def _start_gunicorn(app, worker_class, port):
+    env = {
+        **os.environ,
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        'SESSION_SECRET': app.secret_key,
+    }
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:app'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + GUNICORN_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn ({worker_class}) exited:\n{process.stderr.read()}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/offline')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not answer within {GUNICORN_START_TIMEOUT}s')
+
+def _stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def _drive_http(port, path, cookies, args):
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        rng = random.Random(args.seed + index)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            headers = {'Cookie': rng.choice(cookies)} if cookies else {}
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                # A redirect to /login would mean the session cookie was refused.
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                ok = False
+            recorder.add(path, time.perf_counter() - start, 0, ok)
+        connection.close()
+
+    elapsed = _run_threads(worker, args.concurrency)
+    return recorder.samples[path], recorder.errors[path], elapsed
+
+def _serving_shape(worker_class):
+    import serving
+    previous = os.environ.get('GUNICORN_WORKER_CLASS')
+    os.environ['GUNICORN_WORKER_CLASS'] = worker_class
+    try:
+        return serving.workers(), serving.requests_per_worker()
+    finally:
+        if previous is None:
+            os.environ.pop('GUNICORN_WORKER_CLASS')
+        else:
+            os.environ['GUNICORN_WORKER_CLASS'] = previous
+
+def run_gunicorn(app, user_ids, args):
+    cookies = _session_cookies(app, user_ids)
+    results = {}
+    for worker_class in args.worker_classes.split(','):
+        workers, per_worker = _serving_shape(worker_class)
+        port = _free_port()
+        process = _start_gunicorn(app, worker_class, port)
+        try:
+            endpoints = {}
+            for endpoint, path, logged_in in HTTP_ENDPOINTS:
+                samples, errors, elapsed = _drive_http(port, path, cookies if logged_in else None, args)
+                latencies = sorted(seconds for seconds, _ in samples)
+                endpoints[endpoint] = {
+                    'requests': len(samples),
+                    'errors': errors,
+                    'throughput': len(samples) / elapsed,
+                    'p50_ms': _percentile(latencies, 0.50) * 1000,
+                    'p95_ms': _percentile(latencies, 0.95) * 1000,
+                }
+        finally:
+            _stop_gunicorn(process)
+        results[worker_class] = {'workers': workers, 'per_worker': per_worker, 'endpoints': endpoints}
+    return results
+
+def _print_gunicorn_results(results):
+    print(f'{"worker class":<14}{"shape":>8}  {"endpoint":<16}{"reqs":>7}{"err":>5}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}')
+    for worker_class, run in results.items():
+        shape = f'{run["workers"]}x{run["per_worker"]}'
+        for endpoint, row in run['endpoints'].items():
+            print(f'{worker_class:<14}{shape:>8}  {endpoint:<16}{row["requests"]:>7}{row["errors"]:>5}'
+                  f'{row["throughput"]:>9.1f}{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}')
+
+def _run_threads(target, count):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(recorder, elapsed):
+    results = {}
+    for endpoint in sorted(recorder.samples):
+        samples = recorder.samples[endpoint]
+        latencies = sorted(seconds for seconds, _ in samples)
+        statements = [count for _, count in samples]
+        results[endpoint] = {
+            'requests': len(samples),
+            'errors': recorder.errors[endpoint],
+            'throughput': len(samples) / elapsed,
+            'p50_ms': _percentile(latencies, 0.50) * 1000,
+            'p95_ms': _percentile(latencies, 0.95) * 1000,
+            'p99_ms': _percentile(latencies, 0.99) * 1000,
+            'sql_mean': sum(statements) / len(statements),
+            'sql_max': max(statements),
+        }
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _print_results(results, elapsed):
+    print(f'{"endpoint":<20}{"reqs":>7}{"err":>5}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"sql":>6}{"max":>5}')
+    for endpoint, row in results.items():
+        print(f'{endpoint:<20}{row["requests"]:>7}{row["errors"]:>5}{row["throughput"]:>9.1f}'
+              f'{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}{row["sql_mean"]:>6.1f}{row["sql_max"]:>5}')
+    total = sum(row['requests'] for row in results.values())
+    print(f'{"total":<20}{total:>7}{"":>5}{total / elapsed:>9.1f}   in {elapsed:.1f}s')
+
+def _print_comparison(results, results_meta, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f'\nversus {baseline_path} (commit {baseline["meta"].get("commit")})')
+    if baseline['meta'].get('scenario') != results_meta['scenario']:
+        print(f'warning: baseline ran the {baseline["meta"].get("scenario")} scenario')
+    print(f'{"endpoint":<20}{"req/s":>9}{"p95":>9}{"sql":>9}')
+    for endpoint, row in results.items():
+        old = baseline['endpoints'].get(endpoint)
+        if old is None:
+            continue
+        def change(key):
+            return f'{(row[key] - old[key]) / old[key] * 100:+.0f}%' if old[key] else 'n/a'
+        print(f'{endpoint:<20}{change("throughput"):>9}{change("p95_ms"):>9}{row["sql_mean"] - old["sql_mean"]:>+9.1f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', choices=('mixed', 'midnight', 'gunicorn'), default='mixed')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--history', type=int, default=20, help='past transactions and completions per user')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0,
+                        help='seconds, for the mixed scenario and per endpoint for gunicorn')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier --json file to compare against')
+    parser.add_argument('--budgets-only', action='store_true', help='only check the SQL statement budgets')
+    parser.add_argument('--database-url', help='database to seed and use instead of a throwaway SQLite file')
+    parser.add_argument('--force', action='store_true', help='use --database-url even if it already has users')
+    parser.add_argument('--worker-classes', default='sync,gthread,gevent',
+                        help='comma-separated worker classes, gunicorn scenario only')
+    args = parser.parse_args()
+
+    app = _boot(args.database_url, args.force)
+    user_ids, quest_ids = _seed(app, args.users, args.history)
+    failures = check_budgets(app, user_ids[0])
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures or args.budgets_only:
+        sys.exit(1 if failures else 0)
+    with app.app_context():
+        from models import db
+        counter = SqlCounter(db.engine)
+        dialect = db.engine.dialect.name
+    meta = {
+        'commit': _git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'database': dialect,
+        'cpus': len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+        **{name: getattr(args, name) for name in ('scenario', 'users', 'history', 'concurrency', 'duration', 'seed')},
+    }
+
+    if args.scenario == 'gunicorn':
+        results = run_gunicorn(app, user_ids, args)
+        _print_gunicorn_results(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'meta': meta, 'gunicorn': results}, f, indent=2, sort_keys=True)
+        return
+
+    run = run_mixed if args.scenario == 'mixed' else run_midnight
+    recorder, elapsed = run(app, user_ids, quest_ids, counter, args)
+    results = summarize(recorder, elapsed)
+    _print_results(results, elapsed)
+
+    meta['elapsed'] = elapsed
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'endpoints': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        _print_comparison(results, meta, args.compare)
+
+if __name__ == '__main__':
+    main()
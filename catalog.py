@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Quest, get_cache_version, bump_cache_version
+
+# Process-local, read-only copy of the quest catalog. The catalog only
+# changes through init_quests() or admin edits, which call invalidate(); other
+# workers notice through the shared 'quests' version stamp, checked at most
+# once every VERSION_CHECK_INTERVAL seconds.
+
+CACHE_NAME = 'quests'
+VERSION_CHECK_INTERVAL = 30
+REFERRAL_UNLOCK_DAYS = 2
+
+QuestSnapshot = namedtuple('QuestSnapshot', 'id title description icon order action_url action_type')
+
+class QuestCatalog:
+    def __init__(self, check_interval=VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # (quests, quests by id), replaced in a single assignment so readers
+        # outside the lock never see one without the other.
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            version = get_cache_version(CACHE_NAME)
+            if self._snapshot is None or version != self._version:
+                quests = tuple(
+                    QuestSnapshot(q.id, q.title, q.description, q.icon, q.order, q.action_url, q.action_type)
+                    for q in Quest.query.order_by(Quest.order, Quest.id).all()
+                )
+                self._snapshot = (quests, {quest.id: quest for quest in quests})
+                self._version = version
+            self._checked_at = now
+            return self._snapshot
+
+    def all(self):
+        return self._load()[0]
+
+    def get(self, quest_id):
+        return self._load()[1].get(quest_id)
+
+    def visible_for(self, days_since_registration):
+        return [
+            quest for quest in self.all()
+            if quest.action_type != 'referral' or days_since_registration >= REFERRAL_UNLOCK_DAYS
+        ]
+
+    def invalidate(self):
+        # Bumps the shared version in the caller's transaction. This worker's
+        # copy is dropped once that commits: dropped earlier, a request in
+        # between would reload the old quests and cache them under the old
+        # version, which the commit then makes look current.
+        bump_cache_version(CACHE_NAME)
+        db.session.info['invalidate_catalog'] = True
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+
+quest_catalog = QuestCatalog()
+
+@event.listens_for(Session, 'after_commit')
+def _clear_committed_catalog(session):
+    if session.info.pop('invalidate_catalog', False):
+        quest_catalog.clear()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_catalog_invalidation(session, previous_transaction):
+    session.info.pop('invalidate_catalog', None)
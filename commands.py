@@ -0,0 +1,266 @@
+import time
+from datetime import datetime
+from contextlib import contextmanager
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from models import db, User, Quest
+from migrations import upgrade
+from catalog import quest_catalog
+from assets import build_assets
+from dataset import generate_dataset, DATASET_PASSWORD, DEFAULT_BATCH_SIZE
+import exports
+from rollup import rollup_completions, COMPLETION_DETAIL_MONTHS, ROLLUP_ARCHIVE, ROLLUP_BATCH_USERS
+from referrals import repair_referral_counts, REPAIR_BATCH_SIZE, backfill_referral_tree, downline_by_depth, downline_totals, upline, find_user
+
+# One-shot setup that used to run on import in every worker, in two parts:
+# - `flask --app main init-db` touches only the database (schema upgrade,
+#   quests, admin account) and runs once per deploy, in the release step;
+# - `flask --app main build` writes static/dist and the Jinja bytecode cache
+#   without touching the database, so it runs at build time, on the
+#   filesystem the web processes are started from.
+# `flask --app main bootstrap` runs both, for hosts with a single build step.
+# Each step is idempotent, and on PostgreSQL init-db holds an advisory lock
+# so concurrent releases queue instead of racing.
+
+BOOTSTRAP_LOCK_ID = 728_301_551
+
+QUESTS_DATA = [
+    {
+        "order": 1,
+        "title": "Suivre MrBeast sur YouTube",
+        "description": "Abonnez-vous à la chaîne YouTube de MrBeast",
+        "icon": "youtube",
+        "action_url": "https://www.youtube.com/@MrBeast",
+        "action_type": "subscribe"
+    },
+    {
+        "order": 2,
+        "title": "Inviter un ami",
+        "description": "Parrainez au moins une personne avec votre lien de parrainage",
+        "icon": "users",
+        "action_url": "",
+        "action_type": "referral"
+    },
+    {
+        "order": 3,
+        "title": "Rejoindre Telegram",
+        "description": "Rejoignez notre groupe Telegram",
+        "icon": "telegram",
+        "action_url": "https://t.me/mrbeast",
+        "action_type": "join"
+    },
+    {
+        "order": 4,
+        "title": "Suivre sur TikTok",
+        "description": "Suivez notre compte TikTok",
+        "icon": "tiktok",
+        "action_url": "https://www.tiktok.com/@mrbeast",
+        "action_type": "follow"
+    },
+]
+
+QUEST_FIELDS = ('title', 'description', 'icon', 'action_url', 'action_type')
+
+def init_quests():
+    existing = {quest.order: quest for quest in Quest.query.all()}
+    changed = False
+    for quest_data in QUESTS_DATA:
+        quest = existing.get(quest_data["order"])
+        if quest is None:
+            db.session.add(Quest(**quest_data))
+            changed = True
+            continue
+        for field in QUEST_FIELDS:
+            if getattr(quest, field) != quest_data[field]:
+                setattr(quest, field, quest_data[field])
+                changed = True
+    if changed:
+        quest_catalog.invalidate()
+    db.session.commit()
+    return changed
+
+def create_admin():
+    admin = User.query.filter_by(email='admin@questmoney.com').first()
+    if not admin:
+        admin = User(username='Admin', email='admin@questmoney.com', is_admin=True)
+        admin.set_password('admin123')
+        db.session.add(admin)
+        db.session.commit()
+
+def precompile_templates(app):
+    # Compiling through the environment fills the in-memory template cache
+    # and, when a bytecode cache is configured, writes it for later processes.
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+@contextmanager
+def bootstrap_lock():
+    if db.engine.dialect.name != 'postgresql':
+        yield
+        return
+    # Autocommit, so the lock holder is not an open transaction that
+    # CREATE INDEX CONCURRENTLY in upgrade() would wait on.
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': BOOTSTRAP_LOCK_ID})
+        try:
+            yield
+        finally:
+            connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': BOOTSTRAP_LOCK_ID})
+            connection.commit()
+
+def bootstrap():
+    with bootstrap_lock():
+        upgrade()
+        init_quests()
+        create_admin()
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create or upgrade the schema, seed the quests and the admin account."""
+    bootstrap()
+    click.echo('Base de données initialisée.')
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_templates_command():
+    """Compile every Jinja template into the bytecode cache."""
+    count = precompile_templates(current_app)
+    click.echo(f'{count} templates compilés.')
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Write content-hashed copies of static files to static/dist."""
+    manifest = build_assets(current_app.static_folder)
+    click.echo(f'{len(manifest)} fichiers statiques empreintés.')
+
+@click.command('generate-dataset')
+@click.option('--users', default=10000, show_default=True, help='Number of users to create.')
+@click.option('--months', default=6, show_default=True, help='Length of the simulated history.')
+@click.option('--seed', default=0, show_default=True, help='Random seed; the same seed gives the same data.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per COPY or executemany.')
+@click.option('--anchor-date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='UTC day the history ends before (YYYY-MM-DD); today by default. Pass it to reproduce a dataset.')
+@with_appcontext
+def generate_dataset_command(users, months, seed, batch_size, anchor_date):
+    """Fill the database with synthetic users and activity for scale testing."""
+    anchor_date = anchor_date.date() if anchor_date else datetime.utcnow().date()
+    started = time.perf_counter()
+    counts = generate_dataset(users, months, seed, batch_size, anchor_date)
+    elapsed = time.perf_counter() - started
+    summary = ', '.join(f'{count} {table}' for table, count in counts.items())
+    click.echo(f'Jeu de données généré en {elapsed:.1f}s: {summary}.')
+    click.echo(f'Ancrage: --seed {seed} --anchor-date {anchor_date.isoformat()} (à repasser pour le reproduire)')
+    click.echo(f'Mot de passe des comptes générés: {DATASET_PASSWORD}')
+
+@click.command('export')
+@click.argument('kind', type=click.Choice(sorted(exports.EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(exports.FORMATS)), default='csv', show_default=True)
+@click.option('--status', help='Transactions only: pending, approved or rejected.')
+@click.option('--type', 'tx_type', help='Transactions only: deposit or withdrawal.')
+@click.option('--since', help='First UTC day included (YYYY-MM-DD).')
+@click.option('--until', help='Last UTC day included (YYYY-MM-DD).')
+@click.option('--chunk-size', default=exports.EXPORT_CHUNK_SIZE, show_default=True, help='Rows fetched per round trip.')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Output file (stdout by default).')
+@with_appcontext
+def export_command(kind, fmt, status, tx_type, since, until, chunk_size, output):
+    """Stream transactions, quest completions or users as CSV or JSON Lines."""
+    try:
+        chunks = exports.stream_export(kind, fmt, status=status, tx_type=tx_type, since=since, until=until,
+                                       chunk_size=chunk_size)
+    except exports.ExportError as e:
+        raise click.UsageError(e.message)
+    for chunk in chunks:
+        output.write(chunk)
+
+@click.command('rollup-completions')
+@click.option('--detail-months', default=COMPLETION_DETAIL_MONTHS, show_default=True,
+              help='Full months kept as detail rows besides the current one.')
+@click.option('--archive/--drop', default=ROLLUP_ARCHIVE, show_default=True,
+              help='Move folded rows to quest_completion_archive or delete them.')
+@click.option('--batch-users', default=ROLLUP_BATCH_USERS, show_default=True, help='User ids per transaction.')
+@with_appcontext
+def rollup_completions_command(detail_months, archive, batch_users):
+    """Fold old quest completions into monthly summaries."""
+    if detail_months < 0 or batch_users < 1:
+        raise click.UsageError('--detail-months doit être positif et --batch-users au moins 1.')
+    started = time.perf_counter()
+    counts = rollup_completions(detail_months, archive, batch_users)
+    elapsed = time.perf_counter() - started
+    where = 'archivées' if archive else 'supprimées'
+    click.echo(f"{counts['completions']} complétions antérieures au {counts['cutoff']:%d/%m/%Y} {where}, "
+               f"{counts['summaries']} résumés mensuels écrits en {elapsed:.1f}s.")
+
+@click.command('repair-referral-counts')
+@click.option('--batch-size', default=REPAIR_BATCH_SIZE, show_default=True, help='User ids per transaction.')
+@with_appcontext
+def repair_referral_counts_command(batch_size):
+    """Recompute every user's referral and qualified-referral counters."""
+    started = time.perf_counter()
+    fixed = repair_referral_counts(batch_size)
+    click.echo(f'{fixed} compteur(s) de parrainage corrigé(s) en {time.perf_counter() - started:.1f}s.')
+
+@click.command('backfill-referral-tree')
+@with_appcontext
+def backfill_referral_tree_command():
+    """Add the missing referral closure rows for existing users."""
+    started = time.perf_counter()
+    inserted = backfill_referral_tree()
+    click.echo(f'{inserted} lien(s) de parrainage ajouté(s) en {time.perf_counter() - started:.1f}s.')
+
+@click.command('referral-tree')
+@click.argument('user')
+@click.option('--max-depth', type=int, help='Only count levels down to this depth.')
+@with_appcontext
+def referral_tree_command(user, max_depth):
+    """Show a user's upline and downline aggregates by depth (USER: id, email or username)."""
+    found = find_user(user)
+    if found is None:
+        raise click.UsageError(f'Utilisateur introuvable: {user}')
+    chain = ' <- '.join(f'{username} (#{user_id})' for depth, user_id, username in upline(found.id))
+    click.echo(f'{found.username} (#{found.id})' + (f' <- {chain}' if chain else ''))
+    levels = downline_by_depth(found.id, max_depth)
+    click.echo(f"{'niveau':>6} {'filleuls':>10} {'déposants':>10} {'dépôts ($)':>14}")
+    for level in levels:
+        click.echo(f'{level.depth:>6} {level.members:>10} {level.depositors:>10} {level.total_deposit:>14.2f}')
+    totals = downline_totals(levels)
+    click.echo(f"{'total':>6} {totals.members:>10} {totals.depositors:>10} {totals.total_deposit:>14.2f}")
+
+def build(app):
+    manifest = build_assets(app.static_folder)
+    count = precompile_templates(app)
+    return len(manifest), count
+
+@click.command('build')
+@with_appcontext
+def build_command():
+    """Build step: build-assets and precompile-templates (no database access)."""
+    assets, templates = build(current_app)
+    click.echo(f'{assets} fichiers statiques empreintés, {templates} templates compilés.')
+
+@click.command('bootstrap')
+@with_appcontext
+def bootstrap_command():
+    """init-db followed by build, for hosts with a single build step."""
+    bootstrap()
+    assets, templates = build(current_app)
+    click.echo(f'Base de données initialisée, {assets} fichiers statiques empreintés, {templates} templates compilés.')
+
+def register_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(precompile_templates_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(build_command)
+    app.cli.add_command(bootstrap_command)
+    app.cli.add_command(generate_dataset_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(rollup_completions_command)
+    app.cli.add_command(repair_referral_counts_command)
+    app.cli.add_command(backfill_referral_tree_command)
+    app.cli.add_command(referral_tree_command)
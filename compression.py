@@ -0,0 +1,143 @@
+import gzip
+import mimetypes
+import os
+import zlib
+from flask import send_from_directory
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response compression. Static assets are compressed once at build time
+# (precompress() writes .gz and, when the brotli package is installed, .br
+# siblings) and picked by send_static() according to Accept-Encoding.
+# Dynamic responses go through CompressionMiddleware, which compresses
+# complete text bodies above a size threshold. Streamed responses (no
+# Content-Length) are passed through untouched.
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.html', '.txt', '.map')
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml',
+    'image/svg+xml', 'application/manifest+json',
+)
+
+def _accepts(accept_encoding, encoding):
+    return parse_accept_header(accept_encoding or '')[encoding] > 0
+
+def precompress(path):
+    if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    variants = [('.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', lambda: brotli.compress(data, quality=11)))
+    for suffix, compress in variants:
+        target = path + suffix
+        if os.path.exists(target):
+            continue
+        compressed = compress()
+        if len(compressed) >= len(data):
+            continue
+        with open(target + '.tmp', 'wb') as f:
+            f.write(compressed)
+        os.replace(target + '.tmp', target)
+        written.append(target)
+    return written
+
+def send_static(static_folder, filename, accept_encoding):
+    mimetype = mimetypes.guess_type(filename)[0]
+    candidates = []
+    if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+        candidates = [('br', '.br'), ('gzip', '.gz')]
+    for encoding, suffix in candidates:
+        if _accepts(accept_encoding, encoding) and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    response = send_from_directory(static_folder, filename, mimetype=mimetype)
+    if candidates:
+        response.vary.add('Accept-Encoding')
+    return response
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=1024, level=6, brotli_quality=4):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+
+    def _choose_encoding(self, environ):
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return None
+        accept_encoding = environ.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and _accepts(accept_encoding, 'br'):
+            return 'br'
+        if _accepts(accept_encoding, 'gzip'):
+            return 'gzip'
+        return None
+
+    def _should_compress(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        values = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in values:
+            return False
+        content_type = values.get('content-type', '')
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        length = values.get('content-length')
+        return length is not None and length.isdigit() and int(length) >= self.min_size
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+
+    def __call__(self, environ, start_response):
+        encoding = self._choose_encoding(environ)
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        captured = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None
+
+        app_iter = self.app(environ, capture_start_response)
+        status, headers, exc_info = captured
+        if not self._should_compress(status, headers):
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        compressed = self.compress(body, encoding)
+        if len(compressed) >= len(body):
+            start_response(status, headers, exc_info)
+            return [body]
+
+        # The compressed body is a different representation, so a strong
+        # ETag is downgraded to a weak one.
+        headers = [
+            (name, 'W/' + value if name.lower() == 'etag' and not value.startswith('W/') else value)
+            for name, value in headers
+            if name.lower() != 'content-length'
+        ]
+        vary = [value for name, value in headers if name.lower() == 'vary']
+        headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+        headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+        headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(len(compressed))))
+        start_response(status, headers, exc_info)
+        return [compressed]
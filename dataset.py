@@ -0,0 +1,221 @@
+import csv
+import io
+import math
+import random
+from datetime import datetime, timedelta
+from models import db, User, Quest, QuestCompletion, Transaction
+from passwords import password_hasher
+import balance
+from referrals import backfill_referral_tree
+
+# Synthetic data for scale testing (`flask generate-dataset`). Rows are built
+# in Python from a seeded random generator, with activity ending the day
+# before an anchor date (today by default, so today's daily limits start
+# empty and recent transactions are still pending). The same arguments and
+# anchor give the same dataset on any day, all but the shared password hash,
+# which werkzeug salts at random. Rows are written in batches: COPY on
+# PostgreSQL, executemany elsewhere.
+#
+# Shape of the data:
+# - sign-ups accelerate over the period; half the users were referred, with
+#   popular referrers attracting more referrals;
+# - 40% of users deposit (log-normal amounts, minimum 200$); deposits older
+#   than two days are approved or, sometimes, rejected and retried;
+# - depositors come back on a share of days that varies per user and
+#   complete one to four quests in order;
+# - some active days end with a withdrawal of up to 150$; recent ones are
+#   still pending, older ones approved or rejected.
+
+DATASET_PASSWORD = 'dataset-password'
+DEFAULT_BATCH_SIZE = 5000
+
+REFERRED_SHARE = 0.5
+DEPOSITOR_SHARE = 0.4
+MIN_DEPOSIT = 200.0
+WITHDRAWAL_CHANCE = 0.3
+
+USER_COLUMNS = (
+    'id', 'username', 'email', 'password_hash', 'balance', 'deposit', 'is_admin', 'created_at',
+    'referral_code', 'referred_by_id', 'referral_bonus_earned', 'referral_balance', 'state_version',
+    'referral_count', 'qualified_referral_count',
+)
+TRANSACTION_COLUMNS = (
+    'user_id', 'type', 'amount', 'status', 'wallet_address', 'tx_hash', 'balance_type',
+    'created_at', 'processed_at',
+)
+COMPLETION_COLUMNS = ('user_id', 'quest_id', 'reward', 'completed_at')
+
+class BatchWriter:
+    def __init__(self, connection, batch_size=DEFAULT_BATCH_SIZE):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.use_copy = connection.dialect.name == 'postgresql'
+        # Users are written first so the other tables' foreign keys resolve.
+        self.buffers = {User.__table__: [], Transaction.__table__: [], QuestCompletion.__table__: []}
+        self.columns = {
+            User.__table__: USER_COLUMNS,
+            Transaction.__table__: TRANSACTION_COLUMNS,
+            QuestCompletion.__table__: COMPLETION_COLUMNS,
+        }
+        self.counts = {table.name: 0 for table in self.buffers}
+
+    def add(self, model, row):
+        buffer = self.buffers[model.__table__]
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for table, rows in self.buffers.items():
+            if rows:
+                self._write(table, self.columns[table], rows)
+                self.counts[table.name] += len(rows)
+                rows.clear()
+
+    def _write(self, table, columns, rows):
+        if not self.use_copy:
+            self.connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+            return
+        data = io.StringIO()
+        csv.writer(data).writerows(rows)
+        data.seek(0)
+        preparer = self.connection.dialect.identifier_preparer
+        column_list = ', '.join(preparer.quote(name) for name in columns)
+        sql = f'COPY {preparer.format_table(table)} ({column_list}) FROM STDIN WITH (FORMAT csv)'
+        cursor = self.connection.connection.driver_connection.cursor()
+        try:
+            cursor.copy_expert(sql, data)
+        finally:
+            cursor.close()
+
+def _wallet(rng):
+    return '0x' + format(rng.getrandbits(160), '040x')
+
+def _tx_hash(rng):
+    return '0x' + format(rng.getrandbits(256), '064x')
+
+def _decided(rng, created_at, now, pending_days, rejected_share):
+    # Returns (status, processed_at) for a transaction created at created_at.
+    if created_at > now - timedelta(days=pending_days):
+        return 'pending', None
+    processed_at = created_at + timedelta(hours=rng.uniform(0.5, 36))
+    return ('rejected' if rng.random() < rejected_share else 'approved'), processed_at
+
+def _user_activity(rng, user_id, signed_up, now, quest_ids):
+    # Deposits, quest completions and withdrawals for one user, returned as
+    # (deposit, balance, first deposit approved, transactions, completions).
+    deposit = 0.0
+    balance_left = 0.0
+    first_approved = False
+    transactions = []
+    completions = []
+    if rng.random() >= DEPOSITOR_SHARE:
+        return deposit, balance_left, first_approved, transactions, completions
+
+    amount = round(max(MIN_DEPOSIT, rng.lognormvariate(math.log(300), 0.6)), 2)
+    deposited_at = signed_up + timedelta(hours=rng.expovariate(1 / 48))
+    active_from = None
+    for attempt in range(2):
+        if deposited_at >= now:
+            break
+        status, processed_at = _decided(rng, deposited_at, now, pending_days=2, rejected_share=0.1)
+        transactions.append((user_id, 'deposit', amount, status, None, _tx_hash(rng), 'balance',
+                             deposited_at, processed_at))
+        if status == 'approved':
+            deposit = amount
+            first_approved = True
+            active_from = processed_at
+            break
+        if status == 'pending':
+            break
+        deposited_at = processed_at + timedelta(hours=rng.uniform(1, 24))
+    if active_from is None:
+        return deposit, balance_left, first_approved, transactions, completions
+
+    engagement = rng.betavariate(2, 3)
+    reward = deposit * balance.QUEST_REWARD_RATE
+    day = active_from.date() + timedelta(days=1)
+    last_day = now.date() - timedelta(days=1)
+    while day <= last_day:
+        if rng.random() < engagement:
+            completed = rng.choices((1, 2, 3, 4), (1, 1, 2, 6))[0]
+            moment = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.uniform(0, 20 * 60))
+            for quest_id in quest_ids[:completed]:
+                completions.append((user_id, quest_id, reward, moment))
+                balance_left += reward
+                moment += timedelta(minutes=rng.uniform(0.2, 10))
+            if balance_left > 50 and rng.random() < WITHDRAWAL_CHANCE:
+                withdrawal = round(min(150.0, balance_left * rng.uniform(0.3, 1.0)), 2)
+                status, processed_at = _decided(rng, moment, now, pending_days=3, rejected_share=0.08)
+                transactions.append((user_id, 'withdrawal', withdrawal, status, _wallet(rng), None, 'balance',
+                                     moment, processed_at))
+                if status != 'rejected':
+                    balance_left -= withdrawal
+        day += timedelta(days=1)
+    return deposit, round(balance_left, 2), first_approved, transactions, completions
+
+def generate_dataset(users, months=6, seed=0, batch_size=DEFAULT_BATCH_SIZE, anchor_date=None):
+    rng = random.Random(seed)
+    # Midnight (UTC) starting the anchor day: the simulated "now".
+    now = datetime.combine(anchor_date or datetime.utcnow().date(), datetime.min.time())
+    start = now - timedelta(days=30 * months)
+    span = now - start
+    quest_ids = [quest.id for quest in Quest.query.order_by(Quest.order)]
+    password_hash = password_hasher.hash(DATASET_PASSWORD)
+    first_id = db.session.scalar(db.select(db.func.coalesce(db.func.max(User.id), 0))) + 1
+    db.session.commit()
+
+    # Referrer id -> [referrals, referrals with an approved deposit].
+    referrals = {}
+    referrer_pool = []
+    with db.engine.begin() as connection:
+        writer = BatchWriter(connection, batch_size)
+        for index in range(users):
+            user_id = first_id + index
+            signed_up = start + span * ((index + rng.random()) / users) ** 0.5
+            referred_by_id = None
+            if referrer_pool and rng.random() < REFERRED_SHARE:
+                referred_by_id = rng.choice(referrer_pool)
+                referrer_pool.append(referred_by_id)
+            referrer_pool.append(user_id)
+
+            deposit, balance_left, first_approved, transactions, completions = _user_activity(
+                rng, user_id, signed_up, now, quest_ids
+            )
+            # The user row goes in first so a flush never writes its
+            # transactions ahead of it.
+            writer.add(User, (user_id, f'user{user_id}', f'user{user_id}@example.test', password_hash,
+                              balance_left, deposit, False, signed_up, f'S{user_id:09d}', referred_by_id,
+                              0.0, 0.0, 0, 0, 0))
+            for row in transactions:
+                writer.add(Transaction, row)
+            for row in completions:
+                writer.add(QuestCompletion, row)
+            if referred_by_id is not None:
+                counts = referrals.setdefault(referred_by_id, [0, 0])
+                counts[0] += 1
+                counts[1] += first_approved
+        writer.flush()
+
+        # Referrers are earlier rows, already written: set their referral
+        # counters and pay their bonuses in one executemany.
+        if referrals:
+            connection.execute(
+                db.update(User).where(User.id == db.bindparam('referrer_id')).values(
+                    referral_count=db.bindparam('total'), qualified_referral_count=db.bindparam('qualified'),
+                    referral_balance=db.bindparam('bonus'), referral_bonus_earned=db.bindparam('bonus')
+                ),
+                [
+                    {'referrer_id': referrer_id, 'total': total, 'qualified': qualified,
+                     'bonus': qualified * balance.REFERRAL_BONUS}
+                    for referrer_id, (total, qualified) in referrals.items()
+                ]
+            )
+        # Closure rows are derived from referred_by_id, one INSERT per level.
+        backfill_referral_tree(connection=connection)
+        if connection.dialect.name == 'postgresql':
+            # Explicit ids leave the sequence behind.
+            connection.execute(db.text(
+                "SELECT setval(pg_get_serial_sequence('\"user\"', 'id'), (SELECT max(id) FROM \"user\"))"
+            ))
+    return writer.counts
@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from models import db, User, Quest, QuestCompletion, QuestCompletionArchive, Transaction, utc_day_range
+from replica import read_engine
+
+# Streaming exports of transactions, quest completions and users for
+# reconciliation and accounting (/admin/export/<kind> and `flask export`).
+# Rows come from one Core SELECT executed with yield_per, which on
+# PostgreSQL is a server-side cursor fetched EXPORT_CHUNK_SIZE rows at a
+# time; each chunk is encoded and handed to the caller before the next one
+# is fetched, so memory does not grow with the table. Rows are ordered by id
+# and read from the replica when one is configured.
+
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '1000'))
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# Spreadsheets evaluate cells starting with these characters as formulas.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+class ExportError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+class Export:
+    def __init__(self, columns, timestamp_column, joins=(), filters=None):
+        self.columns = columns
+        self.timestamp_column = timestamp_column
+        self.joins = joins
+        # Filter name -> (column, allowed values).
+        self.filters = filters or {}
+
+    @property
+    def header(self):
+        return [column.key for column in self.columns]
+
+    def statement(self, since=None, until=None, **values):
+        statement = db.select(*self.columns)
+        for target, onclause in self.joins:
+            statement = statement.join(target, onclause)
+        for name, value in values.items():
+            if value in (None, '', 'all'):
+                continue
+            if name not in self.filters:
+                raise ExportError(f'Filtre « {name} » non disponible pour cet export.')
+            column, allowed = self.filters[name]
+            if value not in allowed:
+                raise ExportError(f'Valeur invalide pour « {name} »: {value}.')
+            statement = statement.where(column == value)
+        if since is not None:
+            statement = statement.where(self.timestamp_column >= utc_day_range(since)[0])
+        if until is not None:
+            statement = statement.where(self.timestamp_column < utc_day_range(until)[1])
+        return statement.order_by(self.columns[0])
+
+EXPORTS = {
+    'transactions': Export(
+        [
+            Transaction.id, Transaction.user_id, User.username, Transaction.type, Transaction.amount,
+            Transaction.status, Transaction.balance_type, Transaction.wallet_address, Transaction.tx_hash,
+            Transaction.admin_note, Transaction.created_at, Transaction.processed_at, Transaction.processed_by,
+        ],
+        Transaction.created_at,
+        joins=[(User, User.id == Transaction.user_id)],
+        filters={
+            'status': (Transaction.status, ('pending', 'approved', 'rejected')),
+            'type': (Transaction.type, ('deposit', 'withdrawal')),
+        },
+    ),
+    'completions': Export(
+        [
+            QuestCompletion.id, QuestCompletion.user_id, User.username, QuestCompletion.quest_id,
+            Quest.title.label('quest_title'), QuestCompletion.reward, QuestCompletion.completed_at,
+        ],
+        QuestCompletion.completed_at,
+        joins=[(User, User.id == QuestCompletion.user_id), (Quest, Quest.id == QuestCompletion.quest_id)],
+    ),
+    # Detail rows moved out by the monthly rollup (rollup.py).
+    'archived_completions': Export(
+        [
+            QuestCompletionArchive.id, QuestCompletionArchive.user_id, User.username, QuestCompletionArchive.quest_id,
+            Quest.title.label('quest_title'), QuestCompletionArchive.reward, QuestCompletionArchive.completed_at,
+        ],
+        QuestCompletionArchive.completed_at,
+        joins=[(User, User.id == QuestCompletionArchive.user_id), (Quest, Quest.id == QuestCompletionArchive.quest_id)],
+    ),
+    'users': Export(
+        [
+            User.id, User.username, User.email, User.balance, User.deposit, User.referral_balance,
+            User.referral_bonus_earned, User.referral_code, User.referred_by_id, User.is_admin, User.created_at,
+        ],
+        User.created_at,
+    ),
+}
+
+def parse_day(value):
+    if not value:
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f'Date invalide: {value} (format attendu AAAA-MM-JJ).')
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def _encode_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header is not None:
+        writer.writerow(header)
+    writer.writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+def _encode_jsonl(header, rows):
+    # JSON Lines has no header row; every line carries its keys.
+    keys = rows[0]._fields if rows else ()
+    return ''.join(json.dumps(dict(zip(keys, row)), default=_json_default) + '\n' for row in rows)
+
+ENCODERS = {'csv': _encode_csv, 'jsonl': _encode_jsonl}
+
+def stream_export(kind, fmt='csv', status=None, tx_type=None, since=None, until=None,
+                  chunk_size=EXPORT_CHUNK_SIZE):
+    # Validates everything up front and returns an iterator of text chunks;
+    # nothing is read from the database until it is consumed.
+    if kind not in EXPORTS:
+        raise ExportError(f'Export inconnu: {kind}.')
+    if fmt not in ENCODERS:
+        raise ExportError(f'Format inconnu: {fmt}.')
+    export = EXPORTS[kind]
+    statement = export.statement(since=parse_day(since), until=parse_day(until), status=status, type=tx_type)
+    return _generate(read_engine(), statement, export.header, ENCODERS[fmt], chunk_size)
+
+def _generate(engine, statement, header, encode, chunk_size):
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=chunk_size).execute(statement)
+        for rows in result.partitions():
+            yield encode(header, rows)
+            header = None
+        if header is not None:
+            # Empty export: a CSV still gets its header row.
+            yield encode(header, [])
+
+def export_filename(kind, fmt):
+    return f'questmoney-{kind}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}'
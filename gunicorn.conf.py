@@ -0,0 +1,44 @@
+import os
+import metrics
+import serving
+
+# Loaded automatically by gunicorn from the working directory. The worker
+# model and counts come from serving.py, which app.py also uses to size the
+# database pool; see replit.md for the environment variables.
+
+bind = os.environ.get('GUNICORN_BIND') or f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = serving.worker_class()
+workers = serving.workers()
+threads = serving.threads()
+worker_connections = serving.worker_connections()
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = 20
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Optional worker recycling against slow leaks (0 disables it). gthread
+# workers drop the connections still queued in their backlog when they
+# restart, so keep it off unless a leak calls for it.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+def post_fork(server, worker):
+    if worker_class != 'gevent' or not os.environ.get('DATABASE_URL', '').startswith('postgres'):
+        return
+    # psycopg2 blocks the whole gevent hub on every query unless its wait
+    # callback yields to other greenlets. serving.worker_class() has already
+    # checked that psycogreen is installed.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+def when_ready(server):
+    server.log.info('Serving with %s', serving.describe())
+
+def on_starting(server):
+    metrics.reset_multiprocess_dir()
+
+def child_exit(server, worker):
+    metrics.mark_worker_dead(worker.pid)
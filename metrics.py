@@ -0,0 +1,173 @@
+import os
+import shutil
+import time
+from flask import g, has_request_context, request, abort, current_app
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# Prometheus metrics on /metrics, off unless METRICS_ENABLED=1. When off,
+# no SQLAlchemy or Flask hooks are installed and /metrics is a 404.
+#
+# When on, engine events count the statements of each request, their total
+# time and the slowest one, and the request hooks record them with the
+# request latency, labelled by Flask endpoint. Pool checkout wait and
+# connections in use come from the pool itself. Under gunicorn, set
+# PROMETHEUS_MULTIPROC_DIR to a writable directory: every worker writes its
+# samples there and /metrics sums them, whichever worker answers the scrape
+# (gunicorn.conf.py clears it on start and drops dead workers' files).
+# METRICS_TOKEN, when set, is required as a bearer token.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+SLOW_STATEMENT_SECONDS = float(os.environ.get('SLOW_STATEMENT_SECONDS', '0.5'))
+
+METRICS_ENDPOINT = 'prometheus_metrics'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 20, 50, 100)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+class TimedQueuePool(QueuePool):
+    # QueuePool has no event before a checkout starts waiting, so the wait is
+    # timed around the internal get.
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if _metrics is not None:
+                _metrics.pool_wait.observe(time.perf_counter() - start)
+
+class Metrics:
+    def __init__(self):
+        Histogram = prometheus_client.Histogram
+        Gauge = prometheus_client.Gauge
+        self.request_latency = Histogram(
+            'questmoney_request_duration_seconds', 'Request latency.',
+            ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS)
+        self.request_statements = Histogram(
+            'questmoney_request_sql_statements', 'SQL statements issued per request.',
+            ['endpoint'], buckets=STATEMENT_BUCKETS)
+        self.request_db_time = Histogram(
+            'questmoney_request_db_seconds', 'Total database time per request.',
+            ['endpoint'], buckets=LATENCY_BUCKETS)
+        self.request_slowest_statement = Histogram(
+            'questmoney_request_slowest_statement_seconds', 'Slowest SQL statement of each request.',
+            ['endpoint'], buckets=LATENCY_BUCKETS)
+        self.pool_wait = Histogram(
+            'questmoney_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.',
+            buckets=POOL_WAIT_BUCKETS)
+        self.pool_checked_out = Gauge(
+            'questmoney_db_pool_checked_out', 'Connections currently checked out of the pool.',
+            multiprocess_mode='livesum')
+        self.pool_capacity = Gauge(
+            'questmoney_db_pool_capacity', 'Pool size plus max overflow.',
+            multiprocess_mode='livesum')
+
+_metrics = None
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    if not has_request_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+    stats['count'] += 1
+    stats['time'] += elapsed
+    if elapsed > stats['slowest']:
+        stats['slowest'] = elapsed
+        stats['slowest_statement'] = statement
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.sql_stats = {'count': 0, 'time': 0.0, 'slowest': 0.0, 'slowest_statement': None}
+
+def _finish_request(response):
+    started = g.pop('request_started', None)
+    stats = g.pop('sql_stats', None)
+    if started is None or request.endpoint == METRICS_ENDPOINT:
+        return response
+    endpoint = _endpoint()
+    _metrics.request_latency.labels(endpoint, request.method, str(response.status_code)).observe(
+        time.perf_counter() - started)
+    _metrics.request_statements.labels(endpoint).observe(stats['count'])
+    _metrics.request_db_time.labels(endpoint).observe(stats['time'])
+    _metrics.request_slowest_statement.labels(endpoint).observe(stats['slowest'])
+    if stats['slowest'] >= SLOW_STATEMENT_SECONDS:
+        current_app.logger.warning('Slow SQL statement (%.3fs) in %s: %s',
+                                   stats['slowest'], endpoint, stats['slowest_statement'])
+    return response
+
+def _watch_pool(engine, options):
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return
+    # QueuePool's defaults are a pool of 5 with 10 overflow connections.
+    _metrics.pool_capacity.set(options.get('pool_size', 5) + max(options.get('max_overflow', 10), 0))
+
+    @event.listens_for(pool, 'checkout')
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        _metrics.pool_checked_out.set(pool.checkedout())
+
+    @event.listens_for(pool, 'checkin')
+    def _checkin(dbapi_connection, connection_record):
+        _metrics.pool_checked_out.set(pool.checkedout())
+
+def engine_options():
+    # Merged into SQLALCHEMY_ENGINE_OPTIONS before the engine is created.
+    if not METRICS_ENABLED:
+        return {}
+    return {'poolclass': TimedQueuePool}
+
+def init_metrics(app, db):
+    global _metrics
+    if not METRICS_ENABLED:
+        return
+    if prometheus_client is None:
+        raise RuntimeError('METRICS_ENABLED=1 requires the prometheus-client package')
+    _metrics = Metrics()
+
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        _watch_pool(engine, app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+def render_metrics():
+    if _metrics is None:
+        abort(404)
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), 200, {'Content-Type': prometheus_client.CONTENT_TYPE_LATEST}
+
+def reset_multiprocess_dir():
+    # Called from the gunicorn master before workers start.
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+def mark_worker_dead(pid):
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
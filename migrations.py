@@ -0,0 +1,157 @@
+from datetime import datetime
+from sqlalchemy import inspect, text
+from models import db, User, DailyActivity, QuestCompletion, Transaction, ReferralPath, utc_day_range
+from referrals import repair_referral_counts, backfill_referral_tree
+
+# db.create_all() only creates missing tables; it never touches tables that
+# already exist. upgrade() brings an existing database in line with models.py
+# by adding the columns and indexes that were introduced after the table was
+# first created. Every step is idempotent so it can run on each deploy.
+
+def _add_missing_columns(connection, inspector, table):
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    preparer = connection.dialect.identifier_preparer
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        added.append(column.name)
+        column_type = column.type.compile(dialect=connection.dialect)
+        ddl = f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}'
+        default = column.default.arg if column.default is not None and column.default.is_scalar else None
+        if default is not None:
+            ddl += f' DEFAULT {_literal(default)}'
+        connection.execute(text(ddl))
+    return added
+
+# Keyset pagination sorts on these; rows written before they had a default
+# get their processed_at or, failing that, LEGACY_TIMESTAMP, so they sort
+# last. Then the columns become NOT NULL (PostgreSQL; SQLite cannot alter a
+# column, only new tables get the constraint).
+REQUIRED_TIMESTAMPS = (
+    (User.__table__.c.created_at, None),
+    (QuestCompletion.__table__.c.completed_at, None),
+    (Transaction.__table__.c.created_at, Transaction.__table__.c.processed_at),
+)
+LEGACY_TIMESTAMP = datetime(2000, 1, 1)
+
+def _require_timestamps(connection, inspector):
+    preparer = connection.dialect.identifier_preparer
+    for column, fallback in REQUIRED_TIMESTAMPS:
+        nullable = {c['name']: c['nullable'] for c in inspector.get_columns(column.table.name)}[column.name]
+        if not nullable:
+            continue
+        value = LEGACY_TIMESTAMP if fallback is None else db.func.coalesce(fallback, LEGACY_TIMESTAMP)
+        connection.execute(db.update(column.table).where(column.is_(None)).values({column.name: value}))
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text(
+                f'ALTER TABLE {preparer.format_table(column.table)} ALTER COLUMN {preparer.format_column(column)} SET NOT NULL'
+            ))
+
+def _literal(value):
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _missing_indexes(inspector, table):
+    existing = {index['name'] for index in inspector.get_indexes(table.name)}
+    return [index for index in table.indexes if index.name not in existing]
+
+# On PostgreSQL a plain CREATE INDEX blocks writes to the table for the whole
+# build, so indexes added to existing tables are built with CREATE INDEX
+# CONCURRENTLY, which must run outside a transaction: on an autocommit
+# connection, after the schema transaction has committed. A concurrent build
+# that fails leaves an INVALID index under the same name; the next upgrade
+# drops it and builds it again.
+
+def _drop_invalid_indexes():
+    names = {index.name for table in db.metadata.sorted_tables for index in table.indexes}
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        invalid = connection.scalars(text(
+            'SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE NOT i.indisvalid AND pg_catalog.pg_table_is_visible(c.oid)'
+        )).all()
+        preparer = connection.dialect.identifier_preparer
+        for name in invalid:
+            if name in names:
+                connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {preparer.quote(name)}'))
+
+def _create_indexes_concurrently(indexes):
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        for index in indexes:
+            options = index.dialect_options['postgresql']
+            options['concurrently'] = True
+            try:
+                index.create(bind=connection)
+            finally:
+                options['concurrently'] = False
+
+def _backfill_daily_activity(connection):
+    # Only today's counters matter for the limits; older days are history.
+    start, end = utc_day_range()
+    activity = {}
+    
+    def row(user_id):
+        return activity.setdefault(user_id, {'quest_ids': [], 'withdrawn': 0.0})
+    
+    completions = connection.execute(
+        db.select(QuestCompletion.user_id, QuestCompletion.quest_id)
+        .where(QuestCompletion.completed_at >= start, QuestCompletion.completed_at < end)
+        .order_by(QuestCompletion.completed_at)
+    )
+    for user_id, quest_id in completions:
+        row(user_id)['quest_ids'].append(quest_id)
+    
+    withdrawals = connection.execute(
+        db.select(Transaction.user_id, db.func.sum(Transaction.amount))
+        .where(Transaction.type == 'withdrawal', Transaction.balance_type == 'balance',
+               Transaction.created_at >= start, Transaction.created_at < end)
+        .group_by(Transaction.user_id)
+    )
+    for user_id, total in withdrawals:
+        row(user_id)['withdrawn'] = total or 0.0
+    
+    if activity:
+        today = datetime.utcnow().date()
+        connection.execute(db.insert(DailyActivity), [
+            {
+                'user_id': user_id,
+                'day': today,
+                'quests_completed': len(values['quest_ids']),
+                'completed_quest_ids': ','.join(str(quest_id) for quest_id in values['quest_ids']),
+                'balance_withdrawn': values['withdrawn'],
+            }
+            for user_id, values in activity.items()
+        ])
+
+def upgrade():
+    postgresql = db.engine.dialect.name == 'postgresql'
+    with db.engine.connect() as connection:
+        had_daily_activity = inspect(connection).has_table(DailyActivity.__tablename__)
+        had_referral_path = inspect(connection).has_table(ReferralPath.__tablename__)
+    if postgresql:
+        _drop_invalid_indexes()
+    db.create_all(bind_key=None)
+    deferred_indexes = []
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        added = {}
+        for table in db.metadata.sorted_tables:
+            added[table.name] = _add_missing_columns(connection, inspector, table)
+            for index in _missing_indexes(inspector, table):
+                if postgresql:
+                    deferred_indexes.append(index)
+                else:
+                    index.create(bind=connection)
+        _require_timestamps(connection, inspector)
+        if not had_daily_activity:
+            _backfill_daily_activity(connection)
+        if 'qualified_referral_count' in added[User.__tablename__]:
+            # New counters start at 0; count the existing referrals once.
+            repair_referral_counts(connection=connection)
+        if not had_referral_path:
+            backfill_referral_tree(connection=connection)
+    if deferred_indexes:
+        _create_indexes_concurrently(deferred_indexes)
@@ -1,15 +1,68 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime, date
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, time, timedelta
+from passwords import password_hasher
+from replica import RoutingSession
 import secrets
+from sqlalchemy.exc import IntegrityError
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+DAILY_QUEST_LIMIT = 4
+DAILY_WITHDRAWAL_LIMIT = 150.0
 
 def generate_referral_code():
     return secrets.token_urlsafe(6).upper()[:8]
 
-class User(UserMixin, db.Model):
+def insert_ignore(model, **values):
+    # INSERT that silently does nothing when the primary key already exists.
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(model).values(**values))
+        except IntegrityError:
+            pass
+        return
+    db.session.execute(insert(model).values(**values).on_conflict_do_nothing())
+
+def utc_day_range(day=None):
+    # Half-open [start, end) bounds of a UTC day, so filters on completed_at /
+    # created_at stay sargable and can use the composite indexes below.
+    if day is None:
+        day = datetime.utcnow().date()
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+class DailyLimitsMixin:
+    # Daily quest/withdrawal reads shared by User and the cached session
+    # snapshot; they only need self.id and self.deposit.
+    
+    def get_daily_activity(self, day=None):
+        if day is None:
+            day = datetime.utcnow().date()
+        return db.session.get(DailyActivity, (self.id, day))
+    
+    def get_completed_quest_ids_today(self):
+        activity = self.get_daily_activity()
+        return activity.quest_ids if activity else []
+    
+    def get_completed_quests_today(self):
+        activity = self.get_daily_activity()
+        return activity.quests_completed if activity else 0
+    
+    def can_complete_quest(self):
+        return self.get_completed_quests_today() < DAILY_QUEST_LIMIT and self.deposit > 0
+    
+    def get_daily_withdrawal_total(self):
+        activity = self.get_daily_activity()
+        return activity.balance_withdrawn if activity else 0.0
+
+class User(DailyLimitsMixin, UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -17,42 +70,37 @@ class User(UserMixin, db.Model):
     balance = db.Column(db.Float, default=0.0)
     deposit = db.Column(db.Float, default=0.0)
     is_admin = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     referral_code = db.Column(db.String(10), unique=True, default=generate_referral_code)
     referred_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     referral_bonus_earned = db.Column(db.Float, default=0.0)
     referral_balance = db.Column(db.Float, default=0.0)
+    # Incremented with every change visible on the dashboard (balances,
+    # quests, pending transactions); the dashboard API's ETag is built on it.
+    state_version = db.Column(db.Integer, nullable=False, default=0)
+    # Maintained by referrals.py: users referred, and those of them with an
+    # approved deposit.
+    referral_count = db.Column(db.Integer, nullable=False, default=0)
+    qualified_referral_count = db.Column(db.Integer, nullable=False, default=0)
     
     quests = db.relationship('QuestCompletion', backref='user', lazy=True)
     transactions = db.relationship('Transaction', backref='user', lazy=True, foreign_keys='Transaction.user_id')
     referrals = db.relationship('User', backref=db.backref('referred_by', remote_side='User.id'), foreign_keys='User.referred_by_id')
     
+    __table_args__ = (
+        db.Index('ix_user_is_admin_created', 'is_admin', 'created_at', 'id'),
+        db.Index('ix_user_referred_by', 'referred_by_id'),
+    )
+    
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-    
-    def get_completed_quests_today(self):
-        today = date.today()
-        return QuestCompletion.query.filter(
-            QuestCompletion.user_id == self.id,
-            db.func.date(QuestCompletion.completed_at) == today
-        ).count()
-    
-    def can_complete_quest(self):
-        return self.get_completed_quests_today() < 4 and self.deposit > 0
+        return password_hasher.verify(self.password_hash, password)
     
-    def get_daily_withdrawal_total(self):
-        today = date.today()
-        total = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.user_id == self.id,
-            Transaction.type == 'withdrawal',
-            Transaction.balance_type == 'balance',
-            db.func.date(Transaction.created_at) == today
-        ).scalar()
-        return total or 0.0
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
 class Quest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -68,9 +116,96 @@ class QuestCompletion(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     quest_id = db.Column(db.Integer, db.ForeignKey('quest.id'), nullable=False)
     reward = db.Column(db.Float, nullable=False)
-    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     quest = db.relationship('Quest', backref='completions')
+    
+    __table_args__ = (
+        db.Index('ix_quest_completion_user_completed', 'user_id', 'completed_at', 'id'),
+        db.Index('ix_quest_completion_user_quest_completed', 'user_id', 'quest_id', 'completed_at'),
+    )
+
+class QuestCompletionMonth(db.Model):
+    # Completions older than the detail window, folded by rollup.py into one
+    # row per user per month (month is its first day). quest_breakdown maps
+    # quest ids (as strings) to {"count": n, "reward": total}.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    completions = db.Column(db.Integer, nullable=False, default=0)
+    total_reward = db.Column(db.Float, nullable=False, default=0.0)
+    quest_breakdown = db.Column(db.JSON, nullable=False, default=dict)
+    
+    def breakdown(self):
+        # [(quest_id, count, reward)] in quest id order.
+        return sorted(
+            (int(quest_id), values['count'], values['reward'])
+            for quest_id, values in (self.quest_breakdown or {}).items()
+        )
+
+class QuestCompletionArchive(db.Model):
+    # Detail rows moved out of quest_completion by the rollup, ids kept.
+    __tablename__ = 'quest_completion_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    quest_id = db.Column(db.Integer, nullable=False)
+    reward = db.Column(db.Float, nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_quest_completion_archive_user_completed', 'user_id', 'completed_at'),
+    )
+
+class ReferralPath(db.Model):
+    # Closure of the referral tree, maintained by referrals.py: one row per
+    # (ancestor, descendant) pair at any distance, depth 1 being a direct
+    # referral. Users are not their own ancestors.
+    __tablename__ = 'referral_path'
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_referral_path_ancestor_depth', 'ancestor_id', 'depth', 'descendant_id'),
+        db.Index('ix_referral_path_descendant_depth', 'descendant_id', 'depth'),
+    )
+
+class CacheVersion(db.Model):
+    # Shared version stamps for per-process caches: bumping a name makes every
+    # worker drop its copy on the next version check.
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def get_cache_version(name):
+    version = db.session.execute(
+        db.select(CacheVersion.version).where(CacheVersion.name == name)
+    ).scalar()
+    return version or 0
+
+def bump_cache_version(name):
+    insert_ignore(CacheVersion, name=name, version=0)
+    db.session.execute(
+        db.update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+    )
+
+class DailyActivity(db.Model):
+    # One row per user per UTC day, written in the same transaction as the
+    # completion or withdrawal it counts, so daily limits are a primary-key read.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    quests_completed = db.Column(db.Integer, nullable=False, default=0)
+    completed_quest_ids = db.Column(db.String(200), nullable=False, default='')
+    balance_withdrawn = db.Column(db.Float, nullable=False, default=0.0)
+    
+    @property
+    def quest_ids(self):
+        return [int(quest_id) for quest_id in self.completed_quest_ids.split(',') if quest_id]
+    
+    def record_quest(self, quest_id):
+        self.completed_quest_ids = ','.join(str(qid) for qid in self.quest_ids + [quest_id])
+        self.quests_completed = (self.quests_completed or 0) + 1
+    
+    def record_withdrawal(self, amount):
+        self.balance_withdrawn = (self.balance_withdrawn or 0.0) + amount
 
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -82,6 +217,13 @@ class Transaction(db.Model):
     tx_hash = db.Column(db.String(100))
     admin_note = db.Column(db.Text)
     balance_type = db.Column(db.String(20), default='balance')  # 'balance' or 'referral_balance'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     processed_at = db.Column(db.DateTime)
     processed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    
+    __table_args__ = (
+        db.Index('ix_transaction_user_type_balance_created', 'user_id', 'type', 'balance_type', 'created_at'),
+        db.Index('ix_transaction_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_transaction_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_transaction_created', 'created_at', 'id'),
+    )
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from flask import current_app, make_response, render_template, request, session
+from flask_login import AnonymousUserMixin
+from flask_wtf.csrf import generate_csrf
+
+# Anonymous pages (landing, login, register, offline) are the same for every
+# visitor except for the CSRF token. Each template is rendered once per worker
+# with a placeholder token, then served from memory:
+# - visitors without a session cookie get the page with an empty token and
+#   public Cache-Control, so a reverse proxy can absorb the traffic; forms
+#   fetch their token from /csrf-token (script.js) before submitting;
+# - visitors with a session get their token substituted into the cached
+#   HTML, marked private.
+# A pending flash message or an authenticated user falls back to a normal
+# render. respond() takes no template context: pages that depend on the
+# request (/register?ref=CODE) are rendered by the view itself. Flask-Login
+# reads the session on every request, so responses carry Vary: Cookie;
+# proxies still share one entry between cookie-less requests.
+
+PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE', '1') == '1'
+PAGE_CACHE_MAX_AGE = int(os.environ.get('PAGE_CACHE_MAX_AGE', '60'))
+PAGE_CACHE_SHARED_MAX_AGE = int(os.environ.get('PAGE_CACHE_SHARED_MAX_AGE', '300'))
+
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+
+CachedPage = namedtuple('CachedPage', 'html public_html etag')
+
+def _placeholder_token():
+    return CSRF_PLACEHOLDER
+
+def _no_flashed_messages(with_categories=False, category_filter=()):
+    return []
+
+def has_session_cookie():
+    config = current_app.config
+    return (config['SESSION_COOKIE_NAME'] in request.cookies
+            or config.get('REMEMBER_COOKIE_NAME', 'remember_token') in request.cookies)
+
+class AnonymousPageCache:
+    def __init__(self, enabled=PAGE_CACHE_ENABLED):
+        self.enabled = enabled
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _render(self, template):
+        html = render_template(
+            template,
+            current_user=AnonymousUserMixin(),
+            csrf_token=_placeholder_token,
+            get_flashed_messages=_no_flashed_messages,
+        )
+        public_html = html.replace(CSRF_PLACEHOLDER, '')
+        etag = hashlib.sha256(public_html.encode()).hexdigest()[:16]
+        return CachedPage(html, public_html, etag)
+
+    def get(self, template):
+        page = self._pages.get(template)
+        if page is None:
+            with self._lock:
+                page = self._pages.get(template)
+                if page is None:
+                    page = self._render(template)
+                    self._pages[template] = page
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def respond(self, template):
+        # Callers handle authenticated users before calling respond().
+        if not self.enabled or current_app.debug or request.method != 'GET':
+            return render_template(template)
+
+        if has_session_cookie():
+            if '_flashes' in session:
+                return render_template(template)
+            page = self.get(template)
+            response = make_response(page.html.replace(CSRF_PLACEHOLDER, generate_csrf()))
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        page = self.get(template)
+        response = make_response(page.public_html)
+        response.headers['Cache-Control'] = (
+            f'public, max-age={PAGE_CACHE_MAX_AGE}, s-maxage={PAGE_CACHE_SHARED_MAX_AGE}'
+        )
+        response.set_etag(page.etag)
+        return response.make_conditional(request)
+
+page_cache = AnonymousPageCache()
@@ -0,0 +1,59 @@
+from datetime import datetime
+from flask import request, url_for
+from models import db
+
+# Keyset (cursor) pagination on (timestamp, id), newest first. Each page
+# seeks past the last row of the previous one through the composite
+# indexes, so deep pages cost the same as the first one, unlike OFFSET.
+
+PAGE_SIZE = 50
+
+class KeysetPage:
+    def __init__(self, items, cursor, next_cursor):
+        self.items = items
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+def encode_cursor(timestamp, row_id):
+    return f'{timestamp.isoformat()}_{row_id}'
+
+def decode_cursor(value):
+    if not value:
+        return None
+    timestamp, _, row_id = value.rpartition('_')
+    try:
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        return None
+
+def keyset_paginate(query, timestamp_column, id_column, cursor=None, per_page=PAGE_SIZE):
+    position = decode_cursor(cursor)
+    if position is not None:
+        query = query.filter(db.tuple_(timestamp_column, id_column) < position)
+
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+    return KeysetPage(rows, cursor if position is not None else None, next_cursor)
+
+def page_url(**changes):
+    args = request.args.to_dict()
+    args.update(changes)
+    args = {key: value for key, value in args.items() if value is not None}
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
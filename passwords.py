@@ -0,0 +1,81 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashing is deliberately slow CPU work. It runs on a small
+# per-worker executor whose size caps how many hashes run at once, so a burst
+# of logins cannot take every thread (or the whole gevent hub) away from the
+# other requests. hashlib releases the GIL while hashing, so the rest of the
+# worker keeps serving meanwhile. A request that waits more than
+# PASSWORD_HASH_TIMEOUT seconds for a slot gets PasswordHashingBusy.
+#
+# PASSWORD_HASH_METHOD takes any werkzeug method string, e.g.
+# "scrypt:32768:8:1" or "pbkdf2:sha256:1000000". Stored hashes made with
+# other parameters still verify, and are replaced on the next successful
+# login (see needs_rehash()).
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', '16'))
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', '2'))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '5'))
+
+class PasswordHashingBusy(Exception):
+    pass
+
+def _gevent_threadpool():
+    # Under gevent, threading is monkey-patched and a ThreadPoolExecutor would
+    # run on greenlets; the hub's threadpool uses real OS threads.
+    try:
+        from gevent import monkey, get_hub
+    except ImportError:
+        return None
+    if not monkey.is_module_patched('threading'):
+        return None
+    return get_hub().threadpool
+
+class PasswordHasher:
+    def __init__(self, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH,
+                 concurrency=PASSWORD_HASH_CONCURRENCY, timeout=PASSWORD_HASH_TIMEOUT):
+        self.method = method
+        self.salt_length = salt_length
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._method_prefix = None
+
+    def _submit(self, fn, *args):
+        gevent_pool = _gevent_threadpool()
+        if gevent_pool is not None:
+            return gevent_pool.spawn(fn, *args)
+        if self._executor is None:
+            # Created lazily so each forked worker gets its own threads.
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='password-hash')
+        return self._executor.submit(fn, *args)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHashingBusy()
+        try:
+            return self._submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        if self._method_prefix is None:
+            # werkzeug fills in default parameters ("scrypt" becomes
+            # "scrypt:32768:8:1"), so compare against a real hash's prefix.
+            self._method_prefix = generate_password_hash('', self.method, 1).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._method_prefix
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,51 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from models import db
+
+# Helpers for tests and benchmarks that pin down how many SQL statements a
+# view may issue, so an N+1 relationship load in a template fails loudly
+# instead of slowly.
+
+# Upper bounds per endpoint, counting the session user load that base.html
+# triggers when a user is logged in.
+VIEW_QUERY_BUDGETS = {
+    'history': 4,
+    'admin_dashboard': 3,
+    'admin_transactions': 2,
+}
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+@contextmanager
+def count_queries(engine=None):
+    engine = engine or db.engine
+    counter = QueryCounter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = '\n'.join(counter.statements)
+        raise AssertionError(f'{counter.count} SQL statements issued, expected at most {limit}:\n{statements}')
+
+def assert_view_within_budget(client, url, endpoint, engine=None):
+    with assert_max_queries(VIEW_QUERY_BUDGETS[endpoint], engine):
+        response = client.get(url)
+    assert response.status_code == 200, response.status_code
+    return response
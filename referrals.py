@@ -0,0 +1,210 @@
+import os
+from collections import namedtuple
+from models import db, User, Transaction, ReferralPath
+from usercache import invalidate_on_commit
+
+# Referral bookkeeping beyond User.referred_by_id.
+#
+# Denormalized counters on User: referral_count is bumped when a referred
+# user registers and qualified_referral_count when a referred user's first
+# deposit is approved (the event that also pays the referral bonus), so the
+# profile and the referral quest read columns instead of joining a user's
+# referrals to their transactions. Both are single UPDATE ... SET n = n + k
+# statements in the caller's transaction. repair_referral_counts()
+# recomputes them (`flask repair-referral-counts`).
+#
+# Closure table: ReferralPath holds every (ancestor, descendant, depth) pair
+# of the referral tree. A registration copies the referrer's ancestors one
+# level down, so downline size, depth and per-level aggregates are index
+# range scans on (ancestor_id, depth) instead of recursive queries. A
+# referrer never changes after registration, so rows are never updated.
+# backfill_referral_tree() builds the missing rows level by level
+# (`flask backfill-referral-tree`).
+
+REPAIR_BATCH_SIZE = int(os.environ.get('REFERRAL_REPAIR_BATCH_SIZE', '1000'))
+
+PATH_COLUMNS = ('ancestor_id', 'descendant_id', 'depth')
+
+DownlineLevel = namedtuple('DownlineLevel', 'depth members depositors total_deposit')
+
+def record_signup(user_id, referrer_id):
+    if referrer_id is None:
+        return
+    db.session.execute(
+        db.update(User).where(User.id == referrer_id).values(referral_count=User.referral_count + 1),
+        execution_options={'synchronize_session': False}
+    )
+    invalidate_on_commit(referrer_id)
+    db.session.execute(db.insert(ReferralPath).values(ancestor_id=referrer_id, descendant_id=user_id, depth=1))
+    db.session.execute(db.insert(ReferralPath).from_select(
+        PATH_COLUMNS,
+        db.select(ReferralPath.ancestor_id, db.literal(user_id), ReferralPath.depth + 1)
+        .where(ReferralPath.descendant_id == referrer_id)
+    ))
+
+def record_qualified(referrer_ids):
+    # One entry per referred user whose first deposit was just approved.
+    counts = {}
+    for referrer_id in referrer_ids:
+        counts[referrer_id] = counts.get(referrer_id, 0) + 1
+    if not counts:
+        return
+    db.session.execute(
+        db.update(User).where(User.id.in_(list(counts))).values(
+            qualified_referral_count=User.qualified_referral_count + db.case(counts, value=User.id, else_=0)
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    for referrer_id in counts:
+        invalidate_on_commit(referrer_id)
+
+def _has_approved_deposit(user):
+    return db.select(Transaction.id).where(
+        Transaction.user_id == user.id,
+        Transaction.type == 'deposit',
+        Transaction.status == 'approved'
+    ).exists()
+
+def _repair_block(connection, low, high):
+    # Locks the block's rows first, so a registration or an approval waiting
+    # on them is counted either here or by its own increment, never both.
+    stored = {
+        row.id: (row.referral_count, row.qualified_referral_count)
+        for row in connection.execute(
+            db.select(User.id, User.referral_count, User.qualified_referral_count)
+            .where(User.id >= low, User.id < high)
+            .with_for_update()
+        )
+    }
+    referred = db.aliased(User)
+    actual = {
+        referrer_id: (total, qualified)
+        for referrer_id, total, qualified in connection.execute(
+            db.select(
+                referred.referred_by_id,
+                db.func.count(),
+                db.func.count(db.case((_has_approved_deposit(referred), 1)))
+            )
+            .where(referred.referred_by_id >= low, referred.referred_by_id < high)
+            .group_by(referred.referred_by_id)
+        )
+    }
+    fixes = [
+        {'b_id': user_id, 'referral_count': total, 'qualified_referral_count': qualified}
+        for user_id, counts in stored.items()
+        for total, qualified in [actual.get(user_id, (0, 0))]
+        if counts != (total, qualified)
+    ]
+    if fixes:
+        connection.execute(
+            db.update(User).where(User.id == db.bindparam('b_id')).values(
+                referral_count=db.bindparam('referral_count'),
+                qualified_referral_count=db.bindparam('qualified_referral_count')
+            ),
+            fixes
+        )
+    return len(fixes)
+
+def _blocks(connection, batch_size):
+    low, high = connection.execute(db.select(db.func.min(User.id), db.func.max(User.id))).one()
+    if low is None:
+        return []
+    return [(first, first + batch_size) for first in range(low, high + 1, batch_size)]
+
+def repair_referral_counts(batch_size=REPAIR_BATCH_SIZE, connection=None):
+    # Returns the number of users whose counters were wrong. Each block of
+    # user ids is its own transaction, unless the caller passes the
+    # connection of a transaction it owns (the migration does).
+    if connection is not None:
+        return sum(_repair_block(connection, low, high) for low, high in _blocks(connection, batch_size))
+    with db.engine.connect() as probe:
+        blocks = _blocks(probe, batch_size)
+    fixed = 0
+    for low, high in blocks:
+        with db.engine.begin() as block_connection:
+            fixed += _repair_block(block_connection, low, high)
+    return fixed
+
+def find_user(identifier):
+    # By id, email or username, for the admin view and the CLI.
+    identifier = (identifier or '').strip().lstrip('#')
+    if not identifier:
+        return None
+    if identifier.isdigit():
+        return db.session.get(User, int(identifier))
+    return User.query.filter(db.or_(User.email == identifier, User.username == identifier)).first()
+
+def downline_by_depth(user_id, max_depth=None):
+    # [DownlineLevel] for each level below user_id, nearest first.
+    # total_deposit sums the members' current User.deposit.
+    query = (
+        db.select(
+            ReferralPath.depth,
+            db.func.count(),
+            db.func.count(db.case((User.deposit > 0, 1))),
+            db.func.coalesce(db.func.sum(User.deposit), 0.0)
+        )
+        .join(User, User.id == ReferralPath.descendant_id)
+        .where(ReferralPath.ancestor_id == user_id)
+        .group_by(ReferralPath.depth)
+        .order_by(ReferralPath.depth)
+    )
+    if max_depth is not None:
+        query = query.where(ReferralPath.depth <= max_depth)
+    return [DownlineLevel(*row) for row in db.session.execute(query)]
+
+def downline_totals(levels):
+    return DownlineLevel(
+        depth=levels[-1].depth if levels else 0,
+        members=sum(level.members for level in levels),
+        depositors=sum(level.depositors for level in levels),
+        total_deposit=sum(level.total_deposit for level in levels)
+    )
+
+def upline(user_id):
+    # The chain of referrers above user_id as (depth, user id, username).
+    return db.session.execute(
+        db.select(ReferralPath.depth, User.id, User.username)
+        .join(User, User.id == ReferralPath.ancestor_id)
+        .where(ReferralPath.descendant_id == user_id)
+        .order_by(ReferralPath.depth)
+    ).all()
+
+def _backfill_level(connection, depth):
+    # Inserts the missing paths of length depth + 1; depth 0 stands for the
+    # direct referrals read from User.referred_by_id.
+    if depth == 0:
+        ancestor = User.referred_by_id
+        rows = db.select(ancestor, User.id, db.literal(1)).where(ancestor.isnot(None))
+    else:
+        parent = db.aliased(ReferralPath)
+        ancestor = parent.ancestor_id
+        rows = (
+            db.select(ancestor, User.id, parent.depth + 1)
+            .join(User, User.referred_by_id == parent.descendant_id)
+            .where(parent.depth == depth)
+        )
+    missing = ~db.select(ReferralPath.depth).where(
+        ReferralPath.ancestor_id == ancestor, ReferralPath.descendant_id == User.id
+    ).exists()
+    return connection.execute(db.insert(ReferralPath).from_select(PATH_COLUMNS, rows.where(missing))).rowcount
+
+def _has_depth(connection, depth):
+    return connection.scalar(db.select(db.select(ReferralPath.depth).where(ReferralPath.depth == depth).exists()))
+
+def backfill_referral_tree(connection=None):
+    # Idempotent: only adds absent rows, so it can run on a populated table.
+    # Returns the number of rows inserted. Each level is its own transaction
+    # unless the caller passes the connection of a transaction it owns.
+    inserted = _run(connection, _backfill_level, 0)
+    depth = 1
+    while _run(connection, _has_depth, depth):
+        inserted += _run(connection, _backfill_level, depth)
+        depth += 1
+    return inserted
+
+def _run(connection, step, *args):
+    if connection is not None:
+        return step(connection, *args)
+    with db.engine.begin() as step_connection:
+        return step(step_connection, *args)
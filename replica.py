@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+
+# Optional read replica. With DATABASE_REPLICA_URL set, app.py registers it
+# as the "replica" bind and SELECTs issued inside use_replica() (or a view
+# decorated with replica_reads) go there. Everything else stays on the
+# primary:
+# - INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE and flushes;
+# - any read after the session has written in the current request;
+# - the next REPLICA_PIN_SECONDS after a visitor's own write, so a redirect
+#   after a withdrawal or a quest shows the new state (read-your-writes).
+# The replica is probed every REPLICA_CHECK_INTERVAL seconds and marked down
+# on connection errors; while it is down reads use the primary, and a
+# replica_reads view that fails on the replica is retried on the primary.
+
+REPLICA_BIND = 'replica'
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', '10'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '30'))
+
+PIN_SESSION_KEY = 'primary_until'
+
+logger = logging.getLogger(__name__)
+
+def replica_url():
+    url = os.environ.get('DATABASE_REPLICA_URL')
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url or None
+
+class ReplicaHealth:
+    def __init__(self, interval=REPLICA_CHECK_INTERVAL):
+        self.interval = interval
+        self.up = True
+        self._checked_until = 0.0
+        # Re-entrant: a failed probe reaches mark_down through handle_error.
+        self._lock = threading.RLock()
+
+    def available(self, engine):
+        if time.monotonic() < self._checked_until:
+            return self.up
+        with self._lock:
+            if time.monotonic() >= self._checked_until:
+                self.up = self._probe(engine)
+                self._checked_until = time.monotonic() + self.interval
+        return self.up
+
+    def _probe(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except DBAPIError as e:
+            logger.warning('Read replica unreachable, using the primary: %s', e)
+            return False
+        return True
+
+    def mark_down(self):
+        with self._lock:
+            self.up = False
+            self._checked_until = time.monotonic() + self.interval
+
+replica_health = ReplicaHealth()
+
+def watch_replica(engine):
+    @event.listens_for(engine, 'handle_error')
+    def _replica_error(context):
+        if context.is_disconnect or context.connection is None:
+            replica_health.mark_down()
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('use_replica') and not self.info.get('wrote'):
+            if self._flushing or not _is_plain_select(clause):
+                self.info['wrote'] = True
+            else:
+                engine = self._db.engines.get(REPLICA_BIND)
+                if engine is not None and replica_health.available(engine):
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def _is_plain_select(clause):
+    return clause is not None and getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _record_flush(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _record_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_after_write(session):
+    if session.info.pop('wrote', False) and REPLICA_BIND in session._db.engines and has_request_context():
+        flask_session[PIN_SESSION_KEY] = time.time() + REPLICA_PIN_SECONDS
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_write(session, previous_transaction):
+    session.info.pop('wrote', None)
+
+def _pinned_to_primary():
+    return has_request_context() and flask_session.get(PIN_SESSION_KEY, 0) > time.time()
+
+@contextmanager
+def use_replica(enabled=True):
+    # use_replica(False) keeps the reads inside it on the primary, even within
+    # a replica_reads view.
+    from models import db
+    if enabled and (REPLICA_BIND not in db.engines or _pinned_to_primary()):
+        yield
+        return
+    previous = db.session.info.get('use_replica', False)
+    db.session.info['use_replica'] = enabled
+    try:
+        yield
+    finally:
+        db.session.info['use_replica'] = previous
+
+def read_engine():
+    # Engine for a read-only connection opened outside the session (exports),
+    # chosen by the same rules as use_replica().
+    from models import db
+    engine = db.engines.get(REPLICA_BIND)
+    if engine is None or _pinned_to_primary() or not replica_health.available(engine):
+        return db.engine
+    return engine
+
+def replica_reads(view):
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        from models import db
+        try:
+            with use_replica():
+                return view(*args, **kwargs)
+        except DBAPIError:
+            if replica_health.up:
+                raise
+            # The replica failed mid-request; the view only reads, so run it
+            # again on the primary.
+            db.session.rollback()
+            return view(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,133 @@
+import os
+from datetime import date, datetime, time
+from models import db, User, QuestCompletion, QuestCompletionMonth, QuestCompletionArchive
+
+# Monthly rollup of quest completions (`flask rollup-completions`, run from a
+# daily or monthly cron). Completions older than the detail window (the
+# current month plus COMPLETION_DETAIL_MONTHS full months) are folded into
+# QuestCompletionMonth, copied to quest_completion_archive (or dropped when
+# ROLLUP_ARCHIVE=0) and deleted from quest_completion, so the hot table and
+# its indexes only cover the window history() pages through.
+#
+# Users are processed in blocks of ROLLUP_BATCH_USERS ids, reading through
+# the (user_id, completed_at) index. Each block's summaries, archive copy and
+# delete commit together, so an interrupted run resumes cleanly and a row is
+# never counted twice.
+
+COMPLETION_DETAIL_MONTHS = int(os.environ.get('COMPLETION_DETAIL_MONTHS', '3'))
+ROLLUP_ARCHIVE = os.environ.get('ROLLUP_ARCHIVE', '1') == '1'
+ROLLUP_BATCH_USERS = int(os.environ.get('ROLLUP_BATCH_USERS', '500'))
+
+ARCHIVE_COLUMNS = ('id', 'user_id', 'quest_id', 'reward', 'completed_at')
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def rollup_cutoff(detail_months=COMPLETION_DETAIL_MONTHS, today=None):
+    # First day still kept as detail rows.
+    today = today or datetime.utcnow().date()
+    return add_months(date(today.year, today.month, 1), -detail_months)
+
+def _month_of(connection, column):
+    if connection.dialect.name == 'postgresql':
+        return db.func.date_trunc('month', column)
+    return db.func.strftime('%Y-%m-01', column)
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+def _fold_block(connection, cutoff, low, high, archive):
+    # Returns (completions folded, summaries written) for user ids [low, high).
+    in_block = (
+        QuestCompletion.user_id >= low,
+        QuestCompletion.user_id < high,
+        QuestCompletion.completed_at < cutoff,
+    )
+    month = _month_of(connection, QuestCompletion.completed_at)
+    rows = connection.execute(
+        db.select(QuestCompletion.user_id, month, QuestCompletion.quest_id,
+                  db.func.count(), db.func.sum(QuestCompletion.reward))
+        .where(*in_block)
+        .group_by(QuestCompletion.user_id, month, QuestCompletion.quest_id)
+    ).all()
+    if not rows:
+        return 0, 0
+
+    existing = {
+        (summary.user_id, summary.month): summary
+        for summary in connection.execute(
+            db.select(QuestCompletionMonth).where(
+                QuestCompletionMonth.user_id >= low, QuestCompletionMonth.user_id < high
+            )
+        )
+    }
+    summaries = {}
+    for user_id, month_value, quest_id, count, reward in rows:
+        key = (user_id, _as_date(month_value))
+        summary = summaries.get(key)
+        if summary is None:
+            # A month can already be summarized when the window was shortened
+            # or a previous run folded part of it.
+            previous = existing.get(key)
+            summary = summaries[key] = {
+                'completions': previous.completions if previous else 0,
+                'total_reward': previous.total_reward if previous else 0.0,
+                'quest_breakdown': dict(previous.quest_breakdown) if previous else {},
+            }
+        summary['completions'] += count
+        summary['total_reward'] += reward
+        quest = summary['quest_breakdown'].get(str(quest_id), {'count': 0, 'reward': 0.0})
+        summary['quest_breakdown'][str(quest_id)] = {
+            'count': quest['count'] + count,
+            'reward': quest['reward'] + reward,
+        }
+
+    inserts = []
+    updates = []
+    for (user_id, month_value), values in summaries.items():
+        if (user_id, month_value) in existing:
+            updates.append({'b_user_id': user_id, 'b_month': month_value, **values})
+        else:
+            inserts.append({'user_id': user_id, 'month': month_value, **values})
+    if inserts:
+        connection.execute(db.insert(QuestCompletionMonth), inserts)
+    if updates:
+        connection.execute(
+            db.update(QuestCompletionMonth)
+            .where(QuestCompletionMonth.user_id == db.bindparam('b_user_id'),
+                   QuestCompletionMonth.month == db.bindparam('b_month'))
+            .values(completions=db.bindparam('completions'),
+                    total_reward=db.bindparam('total_reward'),
+                    quest_breakdown=db.bindparam('quest_breakdown')),
+            updates
+        )
+
+    if archive:
+        connection.execute(
+            db.insert(QuestCompletionArchive).from_select(
+                ARCHIVE_COLUMNS,
+                db.select(*(getattr(QuestCompletion, name) for name in ARCHIVE_COLUMNS)).where(*in_block)
+            )
+        )
+    deleted = connection.execute(db.delete(QuestCompletion).where(*in_block)).rowcount
+    return deleted, len(summaries)
+
+def rollup_completions(detail_months=COMPLETION_DETAIL_MONTHS, archive=ROLLUP_ARCHIVE,
+                       batch_users=ROLLUP_BATCH_USERS):
+    cutoff = datetime.combine(rollup_cutoff(detail_months), time.min)
+    counts = {'completions': 0, 'summaries': 0, 'cutoff': cutoff.date()}
+    with db.engine.connect() as connection:
+        low, high = connection.execute(db.select(db.func.min(User.id), db.func.max(User.id))).one()
+    if low is None:
+        return counts
+    for first in range(low, high + 1, batch_users):
+        with db.engine.begin() as connection:
+            folded, summaries = _fold_block(connection, cutoff, first, first + batch_users, archive)
+        counts['completions'] += folded
+        counts['summaries'] += summaries
+    return counts
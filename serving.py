@@ -0,0 +1,99 @@
+import importlib.util
+import multiprocessing
+import os
+
+# Worker model and database pool sizing, shared by gunicorn.conf.py (which
+# starts the workers) and app.py (which sizes each worker's SQLAlchemy pool)
+# so both sides agree. Everything is derived from the CPU count and can be
+# overridden through the environment:
+#   GUNICORN_WORKER_CLASS  sync | gthread | gevent (default gthread); gevent
+#                          needs the gevent extra (pip install '.[gevent]')
+#   WEB_CONCURRENCY        number of worker processes
+#   GUNICORN_THREADS       threads per gthread worker
+#   GUNICORN_WORKER_CONNECTIONS  greenlets per gevent worker
+#   DB_MAX_CONNECTIONS     connections the app may open in total, across all
+#                          workers; keep it below Postgres max_connections
+#                          minus what migrations, psql and backups need.
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+DEFAULT_WORKER_CLASS = 'gthread'
+DEFAULT_DB_MAX_CONNECTIONS = 80
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+def worker_class():
+    name = os.environ.get('GUNICORN_WORKER_CLASS', DEFAULT_WORKER_CLASS)
+    if name not in WORKER_CLASSES:
+        raise ValueError(f'GUNICORN_WORKER_CLASS must be one of {", ".join(WORKER_CLASSES)}, not {name!r}')
+    if name == 'gevent':
+        _require_gevent()
+    return name
+
+def _require_gevent():
+    # gevent runs the workers; psycogreen keeps psycopg2 from blocking them.
+    missing = [module for module in ('gevent', 'psycogreen') if importlib.util.find_spec(module) is None]
+    if 'psycogreen' in missing and not os.environ.get('DATABASE_URL', '').startswith('postgres'):
+        missing.remove('psycogreen')
+    if missing:
+        raise RuntimeError(
+            f'GUNICORN_WORKER_CLASS=gevent requires {" and ".join(missing)}: '
+            "install the gevent extra (pip install '.[gevent]') or choose another worker class"
+        )
+
+def workers():
+    cpus = cpu_count()
+    if worker_class() == 'sync':
+        # A sync worker is idle while it waits on Postgres, so oversubscribe.
+        default = 2 * cpus + 1
+    else:
+        default = cpus + 1
+    return _env_int('WEB_CONCURRENCY', default)
+
+def threads():
+    if worker_class() != 'gthread':
+        return 1
+    return _env_int('GUNICORN_THREADS', 4)
+
+def worker_connections():
+    return _env_int('GUNICORN_WORKER_CONNECTIONS', 100)
+
+def requests_per_worker():
+    name = worker_class()
+    if name == 'gthread':
+        return threads()
+    if name == 'gevent':
+        return worker_connections()
+    return 1
+
+def db_pool_options():
+    # Each worker may hold an equal share of DB_MAX_CONNECTIONS, and never
+    # needs more connections than requests it runs at once. DB_POOL_SIZE
+    # lowers how many of those stay open while idle; the rest are overflow
+    # connections, closed when returned. gevent workers that run more
+    # requests than their share wait up to DB_POOL_TIMEOUT for a connection.
+    budget = max(1, _env_int('DB_MAX_CONNECTIONS', DEFAULT_DB_MAX_CONNECTIONS) // workers())
+    limit = min(requests_per_worker(), budget)
+    pool_size = min(limit, _env_int('DB_POOL_SIZE', limit))
+    return {
+        'pool_size': pool_size,
+        'max_overflow': limit - pool_size,
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 10),
+    }
+
+def describe():
+    return {
+        'worker_class': worker_class(),
+        'workers': workers(),
+        'threads': threads(),
+        'worker_connections': worker_connections() if worker_class() == 'gevent' else None,
+        'db_max_connections': _env_int('DB_MAX_CONNECTIONS', DEFAULT_DB_MAX_CONNECTIONS),
+        **db_pool_options(),
+    }
@@ -24,9 +24,9 @@ function completeQuest(questId) {
             document.getElementById('current-balance').textContent = data.new_balance.toFixed(2) + '$';
             document.getElementById('completed-count').textContent = data.completed_today + '/4';
             
-            const balanceDisplay = document.querySelector('.balance-display');
-            if (balanceDisplay) {
-                balanceDisplay.textContent = '💰 ' + data.new_balance.toFixed(2) + '$';
+            const navBalance = document.getElementById('nav-balance');
+            if (navBalance) {
+                navBalance.textContent = data.new_balance.toFixed(2) + '$';
             }
             
             showNotification(data.message, 'success');
@@ -108,3 +108,111 @@ style.textContent = `
     }
 `;
 document.head.appendChild(style);
+
+// Keeps the dashboard stat cards current without reloading the page. The
+// server answers 304 while the ETag (a per-user state version) is unchanged,
+// so idle polls cost one primary-key read.
+const DASHBOARD_POLL_INTERVAL = 30000;
+
+function formatAmount(value) {
+    return Number(value || 0).toFixed(2) + '$';
+}
+
+function setText(id, text) {
+    const element = document.getElementById(id);
+    if (element) element.textContent = text;
+}
+
+function completedQuestIdsInPage() {
+    return Array.from(document.querySelectorAll('.quest-card-horizontal.completed'))
+        .map(card => parseInt(card.id.replace('quest-', ''), 10))
+        .sort((a, b) => a - b);
+}
+
+function startDashboardPolling(container) {
+    const url = container.dataset.liveDashboard;
+    let etag = null;
+    let inFlight = false;
+    
+    function refresh() {
+        if (inFlight || document.visibilityState !== 'visible') return;
+        inFlight = true;
+        const headers = { 'Accept': 'application/json' };
+        if (etag) headers['If-None-Match'] = etag;
+        
+        fetch(url, { headers: headers, cache: 'no-store', credentials: 'same-origin' })
+        .then(response => {
+            if (response.status === 304 || !response.ok) return null;
+            etag = response.headers.get('ETag');
+            return response.json();
+        })
+        .then(data => {
+            if (!data) return;
+            setText('current-balance', formatAmount(data.balance));
+            setText('nav-balance', formatAmount(data.balance));
+            setText('referral-balance', formatAmount(data.referral_balance));
+            setText('deposit-amount', formatAmount(data.deposit));
+            setText('quest-reward', formatAmount(data.quest_reward));
+            setText('completed-count', data.completed_today + '/4');
+            
+            // Quest cards depend on unlock order; a change made elsewhere
+            // (another tab, a new day) is simpler to render server-side.
+            const completed = data.completed_quest_ids.slice().sort((a, b) => a - b);
+            if (completed.join(',') !== completedQuestIdsInPage().join(',')) {
+                window.location.reload();
+            }
+        })
+        .catch(() => {})
+        .finally(() => { inFlight = false; });
+    }
+    
+    setInterval(refresh, DASHBOARD_POLL_INTERVAL);
+    document.addEventListener('visibilitychange', refresh);
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const container = document.querySelector('[data-live-dashboard]');
+    if (container) startDashboardPolling(container);
+});
+
+// Anonymous pages may come from the page cache without a CSRF token (see
+// pagecache.py). Forms with an empty token fetch one before submitting.
+let csrfTokenRequest = null;
+
+function fetchCsrfToken() {
+    const meta = document.querySelector('meta[name="csrf-token"]');
+    if (!csrfTokenRequest) {
+        csrfTokenRequest = fetch(meta.dataset.refreshUrl, { credentials: 'same-origin', cache: 'no-store' })
+            .then(response => response.json())
+            .then(data => {
+                meta.setAttribute('content', data.csrf_token);
+                document.querySelectorAll('input[name="csrf_token"]').forEach(input => {
+                    input.value = data.csrf_token;
+                });
+                return data.csrf_token;
+            })
+            .catch(error => {
+                csrfTokenRequest = null;
+                throw error;
+            });
+    }
+    return csrfTokenRequest;
+}
+
+function setupDeferredCsrf() {
+    const missing = Array.from(document.querySelectorAll('input[name="csrf_token"]')).filter(input => !input.value);
+    if (!missing.length) return;
+    
+    fetchCsrfToken().catch(() => {});
+    missing.forEach(input => {
+        input.form.addEventListener('submit', (submitEvent) => {
+            if (input.value) return;
+            submitEvent.preventDefault();
+            fetchCsrfToken()
+                .then(() => input.form.submit())
+                .catch(() => showNotification('Une erreur est survenue', 'error'));
+        });
+    });
+}
+
+document.addEventListener('DOMContentLoaded', setupDeferredCsrf);
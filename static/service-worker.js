@@ -1,21 +1,24 @@
-const CACHE_NAME = 'questmoney-v1';
+// SW_CONFIG is prepended by the server (/service-worker.js) from the asset
+// manifest: a cache name that changes with the fingerprinted assets and the
+// list of URLs to precache. The fallback keeps the file usable on its own.
+const CONFIG = self.SW_CONFIG || {
+  cacheName: 'questmoney-dev',
+  precacheUrls: ['/offline', '/static/style.css', '/static/script.js', '/static/manifest.json'],
+  immutablePrefix: '/static/dist/'
+};
+
+const PRECACHE = CONFIG.cacheName;
+const RUNTIME_CACHE = CONFIG.cacheName + '-runtime';
 const OFFLINE_URL = '/offline';
 
-const STATIC_ASSETS = [
-  '/',
-  '/offline',
-  '/static/style.css',
-  '/static/script.js',
-  '/static/manifest.json',
-  'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800;900&display=swap',
-  'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css'
-];
+const EXTERNAL_IMMUTABLE_HOSTS = ['fonts.gstatic.com'];
+const EXTERNAL_STYLE_HOSTS = ['fonts.googleapis.com', 'cdnjs.cloudflare.com'];
 
 self.addEventListener('install', (event) => {
   event.waitUntil(
-    caches.open(CACHE_NAME).then((cache) => {
-      console.log('Cache ouvert');
-      return cache.addAll(STATIC_ASSETS);
+    caches.open(PRECACHE).then((cache) => {
+      console.log('Cache ouvert:', PRECACHE);
+      return cache.addAll(CONFIG.precacheUrls);
     })
   );
   self.skipWaiting();
@@ -26,7 +29,7 @@ self.addEventListener('activate', (event) => {
     caches.keys().then((cacheNames) => {
       return Promise.all(
         cacheNames.map((cacheName) => {
-          if (cacheName !== CACHE_NAME) {
+          if (cacheName !== PRECACHE && cacheName !== RUNTIME_CACHE) {
             console.log('Suppression ancien cache:', cacheName);
             return caches.delete(cacheName);
           }
@@ -37,38 +40,70 @@ self.addEventListener('activate', (event) => {
   self.clients.claim();
 });
 
+function cacheFirst(request) {
+  return caches.match(request).then((cached) => {
+    if (cached) {
+      return cached;
+    }
+    return fetch(request).then((response) => {
+      if (response.ok || response.type === 'opaque') {
+        const responseClone = response.clone();
+        caches.open(RUNTIME_CACHE).then((cache) => cache.put(request, responseClone));
+      }
+      return response;
+    });
+  });
+}
+
+function staleWhileRevalidate(event) {
+  const request = event.request;
+  return caches.open(RUNTIME_CACHE).then((cache) => {
+    return cache.match(request).then((cached) => {
+      const network = fetch(request)
+        .then((response) => {
+          if (response.ok || response.type === 'opaque') {
+            cache.put(request, response.clone());
+          }
+          return response;
+        })
+        .catch(() => cached);
+      if (cached) {
+        event.waitUntil(network);
+        return cached;
+      }
+      return network;
+    });
+  });
+}
+
+function networkFirstPage(request) {
+  // Pages are personalized: never stored, only replaced by the offline page.
+  return fetch(request).catch(() => {
+    return caches.match(OFFLINE_URL).then((offline) => {
+      return offline || new Response('', { status: 408, statusText: 'Offline' });
+    });
+  });
+}
+
 self.addEventListener('fetch', (event) => {
-  if (event.request.method !== 'GET') {
+  const request = event.request;
+  if (request.method !== 'GET') {
     return;
   }
 
-  event.respondWith(
-    fetch(event.request)
-      .then((response) => {
-        if (response.status === 200) {
-          const responseClone = response.clone();
-          caches.open(CACHE_NAME).then((cache) => {
-            if (event.request.url.startsWith(self.location.origin) || 
-                event.request.url.includes('fonts.googleapis.com') ||
-                event.request.url.includes('cdnjs.cloudflare.com')) {
-              cache.put(event.request, responseClone);
-            }
-          });
-        }
-        return response;
-      })
-      .catch(() => {
-        return caches.match(event.request).then((cachedResponse) => {
-          if (cachedResponse) {
-            return cachedResponse;
-          }
-          if (event.request.mode === 'navigate') {
-            return caches.match(OFFLINE_URL);
-          }
-          return new Response('', { status: 408, statusText: 'Offline' });
-        });
-      })
-  );
+  const url = new URL(request.url);
+  const sameOrigin = url.origin === self.location.origin;
+
+  if (sameOrigin && url.pathname.startsWith(CONFIG.immutablePrefix)) {
+    event.respondWith(cacheFirst(request));
+  } else if (EXTERNAL_IMMUTABLE_HOSTS.includes(url.hostname) ||
+             (url.hostname === 'cdnjs.cloudflare.com' && url.pathname.includes('/webfonts/'))) {
+    event.respondWith(cacheFirst(request));
+  } else if ((sameOrigin && url.pathname.startsWith('/static/')) || EXTERNAL_STYLE_HOSTS.includes(url.hostname)) {
+    event.respondWith(staleWhileRevalidate(event));
+  } else if (request.mode === 'navigate') {
+    event.respondWith(networkFirstPage(request));
+  }
 });
 
 self.addEventListener('message', (event) => {
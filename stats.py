@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from sqlalchemy import event, literal
+from sqlalchemy.orm import Session
+from models import db, User, Transaction
+
+# Admin dashboard figures come from one UNION ALL aggregate (transactions
+# grouped by type/status plus one row of user totals) and are kept in a
+# per-worker rollup for ADMIN_STATS_TTL seconds. Commits that change a
+# transaction's state call mark_dirty() so this worker recomputes on the
+# next load; other workers catch up when their TTL expires.
+
+ADMIN_STATS_TTL = float(os.environ.get('ADMIN_STATS_TTL', '5'))
+
+TRANSACTION_TYPES = ('deposit', 'withdrawal')
+TRANSACTION_STATUSES = ('pending', 'approved', 'rejected')
+
+def _rollup_query():
+    transactions = db.select(
+        Transaction.type.label('kind'),
+        Transaction.status.label('status'),
+        db.func.count().label('count'),
+        db.func.coalesce(db.func.sum(Transaction.amount), 0.0).label('amount'),
+        literal(0.0).label('balance'),
+    ).group_by(Transaction.type, Transaction.status)
+
+    users = db.select(
+        literal('users').label('kind'),
+        literal('all').label('status'),
+        db.func.count().label('count'),
+        db.func.coalesce(db.func.sum(User.deposit), 0.0).label('amount'),
+        db.func.coalesce(db.func.sum(User.balance), 0.0).label('balance'),
+    ).where(User.is_admin.is_(False))
+
+    return db.union_all(transactions, users)
+
+def compute_admin_stats():
+    stats = {
+        'counts': {(kind, status): 0 for kind in TRANSACTION_TYPES for status in TRANSACTION_STATUSES},
+        'amounts': {(kind, status): 0.0 for kind in TRANSACTION_TYPES for status in TRANSACTION_STATUSES},
+        'total_users': 0,
+        'total_deposits': 0.0,
+        'total_balances': 0.0,
+    }
+    for row in db.session.execute(_rollup_query()):
+        if row.kind == 'users':
+            stats['total_users'] = row.count
+            stats['total_deposits'] = float(row.amount or 0.0)
+            stats['total_balances'] = float(row.balance or 0.0)
+        else:
+            stats['counts'][(row.kind, row.status)] = row.count
+            stats['amounts'][(row.kind, row.status)] = float(row.amount or 0.0)
+
+    stats['pending_deposits'] = stats['counts'][('deposit', 'pending')]
+    stats['pending_withdrawals'] = stats['counts'][('withdrawal', 'pending')]
+    stats['pending_deposit_amount'] = stats['amounts'][('deposit', 'pending')]
+    stats['pending_withdrawal_amount'] = stats['amounts'][('withdrawal', 'pending')]
+    stats['approved_deposit_amount'] = stats['amounts'][('deposit', 'approved')]
+    return stats
+
+class AdminStatsCache:
+    def __init__(self, ttl=ADMIN_STATS_TTL):
+        self.ttl = ttl
+        self._stats = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        stats = self._stats
+        if stats is not None and now < self._expires_at:
+            return stats
+        with self._lock:
+            if self._stats is None or time.monotonic() >= self._expires_at:
+                self._stats = compute_admin_stats()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._stats
+
+    def invalidate(self):
+        with self._lock:
+            self._stats = None
+
+admin_stats = AdminStatsCache()
+
+def mark_dirty():
+    db.session.info['admin_stats_dirty'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    if session.info.pop('admin_stats_dirty', False):
+        admin_stats.invalidate()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_dirty_flag(session, previous_transaction):
+    session.info.pop('admin_stats_dirty', None)
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ.pop('DATABASE_REPLICA_URL', None)
+
+from app import app, asset_manifest
+from assets import IMMUTABLE_CACHE_CONTROL, build_assets
+
+# Cache-Control of fingerprinted static files: only files the manifest
+# points to, and only when they are actually served, are immutable.
+
+class StaticCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        build_assets(app.static_folder)
+        asset_manifest.reload()
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_manifest_asset_is_immutable(self):
+        response = self.client.get('/static/' + asset_manifest.entries['style.css'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+    def test_missing_fingerprinted_path_is_not_immutable(self):
+        response = self.client.get('/static/dist/style.deadbeef0000.css')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+
+    def test_manifest_file_is_not_immutable(self):
+        response = self.client.get('/static/dist/assets-manifest.json')
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+
+if __name__ == '__main__':
+    unittest.main()
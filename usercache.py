@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, User, DailyLimitsMixin
+from replica import use_replica
+
+# Flask-Login calls load_user on every authenticated request. Most of those
+# requests only display the user, so load_user serves an immutable snapshot
+# from a small per-worker LRU with a short TTL instead of a primary-key
+# SELECT. Anything that needs the live row (passwords, money checks) uses
+# load_db_user(); the balance service drops a user's entry whenever it
+# changes their money, both immediately and again once the change commits.
+
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '5'))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '2048'))
+
+SNAPSHOT_FIELDS = (
+    'id', 'username', 'email', 'balance', 'deposit', 'is_admin', 'created_at',
+    'referral_code', 'referred_by_id', 'referral_bonus_earned', 'referral_balance',
+    'referral_count', 'qualified_referral_count',
+)
+
+class UserSnapshot(DailyLimitsMixin, UserMixin):
+    __slots__ = SNAPSHOT_FIELDS
+
+    def __init__(self, row):
+        for name in SNAPSHOT_FIELDS:
+            object.__setattr__(self, name, getattr(row, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserSnapshot is read-only; load the row with load_db_user()')
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.id}>'
+
+class UserCache:
+    def __init__(self, ttl=USER_CACHE_TTL, maxsize=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Reads the columns directly rather than through the identity map,
+        # where another query may have left this user with columns deferred,
+        # and from the primary even in a replica_reads view: the snapshot is
+        # shared with the views that check balances, so it must not lag.
+        with use_replica(False):
+            row = db.session.execute(
+                db.select(*(getattr(User, name) for name in SNAPSHOT_FIELDS)).where(User.id == user_id)
+            ).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(row)
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'ttl': self.ttl,
+                'maxsize': self.maxsize,
+            }
+
+user_cache = UserCache()
+
+def load_db_user(user_id):
+    return db.session.get(User, user_id, populate_existing=True)
+
+def invalidate_on_commit(user_id):
+    user_cache.invalidate(user_id)
+    db.session.info.setdefault('invalidate_users', set()).add(user_id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('invalidate_users', ()):
+        user_cache.invalidate(user_id)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending_invalidations(session, previous_transaction):
+    session.info.pop('invalidate_users', None)